@@ -1,19 +1,27 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import concurrent.futures
 import datetime
+import hashlib
 import json
 import re
 import sys
 from time import time
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
 
-from file_dealer import JbovlasteXmlDealer, JbovlasteZipDealer, RawdictDealer
-from vlaste_builder import (DictionaryBuilder, JbovlasteWordBuilder, Metadata,
-                            WordBuilderForJapanese, ZpDICInfo)
+from file_dealer import (BuildStateDealer, JbovlasteXmlDealer,
+                         JbovlasteZipDealer, RawdictDealer)
+from vlaste_builder import (DictionaryBuilder, Interner, JbovlasteWordBuilder,
+                            Metadata, WordBuilderForJapanese, ZpDICInfo)
+from pipeline import Pipeline, print_reports
+from vlaste_index import BacklinkIndex
 import relationize
 
 LANG_LIST = ["en", "ja", "jbo", "en-simple"]
+# Bump when word building or customizing changes its output,
+# so that ``--incremental`` doesn't reuse words built the old way.
+BUILD_VERSION = 2
 
 
 def make_content(valsi, title_name):
@@ -51,34 +59,51 @@ def make_content(valsi, title_name):
         raise ValueError
 
 
-def make_otmized_word(valsi):
-    builder = JbovlasteWordBuilder()
-    builder.set_entry(int(valsi["definitionid"]), valsi["@word"])
+def word_builder_for(lang):
+    """The WordBuilder class words of ``lang`` are built and customized as."""
+    if lang == "ja":
+        return WordBuilderForJapanese
+    return JbovlasteWordBuilder
+
+
+def make_otmized_word(valsi, interner=None,
+                      builder_class=JbovlasteWordBuilder):
+    if interner is None:
+        interner = Interner()
+    builder = builder_class()
+    builder.add(interner.entry(int(valsi["definitionid"]), valsi["@word"]))
 
     if "selmaho" in valsi.keys():
         selmaho = ": "+valsi["selmaho"]
     else:
         selmaho = ""
-    builder.add_translation(valsi["@type"]+selmaho, [valsi["definition"]])
+    builder.add_translation(interner.string(valsi["@type"]+selmaho),
+                            [valsi["definition"]])
 
     if "@unofficial" in valsi.keys():
         builder.add_tag("unofficial")
 
     if "notes" in valsi.keys():
-        builder.add_content("notes", valsi["notes"])
+        builder.add(interner.content("notes", valsi["notes"]))
 
     for title in ("keyword", "glossword", "rafsi"):
         if title in valsi.keys():
-            builder.add_content(*make_content(valsi, title))
+            builder.add(interner.content(*make_content(valsi, title)))
 
-    builder.add_content("username", valsi["user"]["username"])
+    builder.add(interner.content("username", valsi["user"]["username"]))
     return builder
 
 
-def make_otmized_dictionary(rawdict, lang, zpdic_data={}):
+def make_otmized_dictionary(rawdict, lang, zpdic_data={}, interner=None):
+    """Words share their forms and titles through ``interner``;
+    give the same Interner to build several languages sharing them.
+    Words are built as ``word_builder_for(lang)``."""
+    if interner is None:
+        interner = Interner()
+    builder_class = word_builder_for(lang)
     dictionary_builder = DictionaryBuilder()
     for valsi in rawdict:
-        word = make_otmized_word(valsi)
+        word = make_otmized_word(valsi, interner, builder_class)
         dictionary_builder.append(word)
 
     metadata = Metadata()
@@ -90,26 +115,146 @@ def make_otmized_dictionary(rawdict, lang, zpdic_data={}):
     return dictionary_builder
 
 
+# Stages of ``dictionary_customize``. Word stages run fused in one pass
+# over the words; add a new cleanup as another word stage.
+CUSTOMIZE = Pipeline()
+CustomizeContext = namedtuple("CustomizeContext", "lang args")
+
+
+@CUSTOMIZE.word_stage("japanese", enabled=lambda context: context.lang == "ja")
+def japanese_stage(word, context):
+    if not isinstance(word, WordBuilderForJapanese):
+        # same slots, so the class can be switched without a copy.
+        word.__class__ = WordBuilderForJapanese
+    word.whole_execute()
+    return True
+
+
+@CUSTOMIZE.word_stage("nodollar",
+                      enabled=lambda context: context.args.nodollar)
+def nodollar_stage(word, context):
+    if "$" not in word.translations[0].forms[0]:
+        return False
+    word.delete_dollar()
+    return True
+
+
+# if you wanna keep glossword in contents, run without --keepgloss.
+@CUSTOMIZE.word_stage("keepgloss", requires=("japanese",),
+                      enabled=lambda context: context.args.keepgloss)
+def keepgloss_stage(word, context):
+    glosswords = word.glosswords()
+    if not glosswords:
+        return False
+    word.add_translation("gloss", glosswords)
+    del word.contents[word.contents.find('glossword')[0]]
+    return True
+
+
+@CUSTOMIZE.dictionary_stage("relations",
+                            requires=("japanese", "nodollar", "keepgloss"),
+                            enabled=lambda context: context.args.addrelations)
+def relations_stage(dictionary, context):
+    backlinks = BacklinkIndex()
+    dictionary.words = relationized_words(
+        dictionary,
+        lambda dictionary: relationize.relationize(
+            dictionary, context.args.relationize, backlinks))
+    dictionary.backlinks = backlinks
+    return sum(1 for word in dictionary.words if word.relations)
+
+
+@CUSTOMIZE.dictionary_stage("backlinks", requires=("relations",),
+                            enabled=lambda context: context.args.addbacklinks)
+def backlinks_stage(dictionary, context):
+    return relationize.add_backlinks(dictionary.words, dictionary.backlinks)
+
+
+def word_customize(word, lang, args):
+    return CUSTOMIZE.run_word(word, CustomizeContext(lang, args))
+
+
 def dictionary_customize(dictionary, args):
+    """With ``--jobs`` and a single language,
+    the word stages run in parallel over chunks of words."""
+    lang = dictionary.metadata.langdata["to"]
+    jobs = args.jobs if len(args.language) == 1 else 1
+    reports = CUSTOMIZE.run(dictionary, CustomizeContext(lang, args), jobs)
+    print_reports(reports)
+    return dictionary
+
+
+def valsi_digest(valsi):
+    dumped = json.dumps(valsi, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(dumped.encode('utf-8')).hexdigest()
 
-    if dictionary.metadata.langdata["to"] == "ja":
-        dictionary.words = [WordBuilderForJapanese.load(word.build())
-                            for word in dictionary.words]
 
-    for word in dictionary.words:
-        if dictionary.metadata.langdata["to"] == "ja":
-            word.whole_execute()
-        if args.nodollar:
-            word.delete_dollar()
-        # if you wanna keep glossword in contents, comment-out the block below.
-        if args.keepgloss and word.glosswords():
-            word.add_translation("gloss", word.glosswords())
-            del word.contents[word.contents.find('glossword')[0]]
+def incremental_dictionary(rawdict, lang, args, zpdic_data={}):
+    """Build like ``make_otmized_dictionary`` + ``dictionary_customize``,
+    reusing every word of the last build whose valsi hasn't changed.
+
+    Relations are redone only for new or changed words, and for words
+    referring to a form that was added, removed or re-numbered.
+
+    Records are keyed by ``(definitionid, n)``, the n-th valsi having that
+    id, so that valsi sharing an id never share a record."""
+    state_dealer = BuildStateDealer(lang)
+    signature = (BUILD_VERSION, lang, args.nodollar, args.keepgloss)
+    previous = state_dealer.load(signature)
+    builder = word_builder_for(lang)
+
+    interner = Interner()
+    dictionary = make_otmized_dictionary([], lang, zpdic_data, interner)
+    records = {}
+    keys = []
+    seen = defaultdict(int)
+    rebuilt = 0
+    for valsi in rawdict:
+        id_ = int(valsi["definitionid"])
+        key = (id_, seen[id_])
+        seen[id_] += 1
+        digest = valsi_digest(valsi)
+        if key in previous and previous[key][0] == digest:
+            _, built, relations = previous[key]
+            word = builder.load(built, interner)
+        else:
+            word = word_customize(make_otmized_word(valsi, interner,
+                                                    builder), lang, args)
+            built, relations = word.build(), None
+            rebuilt += 1
+        records[key] = [digest, built, relations]
+        keys.append(key)
+        dictionary.append(word)
+    print("{} words reused, {} words rebuilt."
+          .format(len(records) - rebuilt, rebuilt))
+
+    old_entries = {(key[0], record[1]["entry"]["form"])
+                   for key, record in previous.items()}
+    new_entries = {tuple(word.entry) for word in dictionary.words}
+    changed_forms = {form for _, form in old_entries ^ new_entries}
+    for key, word in zip(keys, dictionary.words):
+        if changed_forms.intersection(relationize.references(word)):
+            records[key][2] = None
 
     if args.addrelations:
-        dictionary.words = relationized_words(dictionary,
-                                              relationize.nightly_relationize)
+        entry_dict = relationize.default_prepare(dictionary)
+        redone = 0
+        for key, word in zip(keys, dictionary.words):
+            record = records[key]
+            if record[2] is None:
+                relationize._worker(word, entry_dict)
+                record[2] = [(relation.title, *relation.entry)
+                             for relation in word.relations]
+                redone += 1
+            else:
+                for relation in record[2]:
+                    word.add_relation(*relation)
+        print("{} words relationized.".format(redone))
+        dictionary.backlinks = BacklinkIndex.from_dictionary(dictionary)
+        if args.addbacklinks:
+            relationize.add_backlinks(dictionary.words, dictionary.backlinks)
 
+    state_dealer.save(signature, records)
     return dictionary
 
 
@@ -130,36 +275,169 @@ def handle_commandline():
     parser.add_argument("--zip", action='store_true')
     parser.add_argument("--nodollar", action='store_true')
     parser.add_argument("--addrelations", action='store_true')
+    parser.add_argument("--addbacklinks", action='store_true')
+    parser.add_argument("--relationize", choices=relationize.MODES,
+                        default="auto")
     parser.add_argument("--output", "-o", nargs='?', default='otm-json/')
     parser.add_argument("--keepgloss", action='store_false')
     parser.add_argument("--test", action='store_true')
+    parser.add_argument("--incremental", action='store_true')
+    parser.add_argument("--jobs", "-j", type=int, default=1)
     args = parser.parse_args()
+    if args.addbacklinks and not args.addrelations:
+        parser.error("--addbacklinks needs --addrelations.")
     return args
 
 
 def create_dictionary(lang, args):
     rawdict_dealer = RawdictDealer(lang)
-    rawdict = rawdict_dealer.load()
+    rawdict = rawdict_dealer.iter_load()
     zpdic = ZpDICInfo(lang)
     zpdic.set_by_lang()
+    if args.incremental:
+        return incremental_dictionary(rawdict, lang, args,
+                                      zpdic_data=zpdic.build())
     dictionary = make_otmized_dictionary(rawdict, lang,
                                          zpdic_data=zpdic.build())
     return dictionary_customize(dictionary, args)
 
-if __name__ == '__main__':
-    args = handle_commandline()
-    langs = args.language
-    output = args.output
-    filename_temp = '{}jbo-{}_otm.json'.format(output, '{}')
-    for lang in langs:
-        filename = filename_temp.format(lang)
-        dictionary = create_dictionary(lang, args)
+
+def build_language(lang, args):
+    """Create and save one language. Runs in a worker with ``--jobs``.
+    Returns the filename, and with ``--zip`` the saved bytes as well."""
+    return save_dictionary(lang, create_dictionary(lang, args), args)
+
+
+def save_dictionary(lang, dictionary, args):
+    filename = '{}jbo-{}_otm.json'.format(args.output, lang)
+    payload = None
     if args.test:
         print('This is test. Dictionary data is not saved.')
     else:
-        dictionary.save(filename)
-    print()
+        payload = dictionary.save(filename, payload=args.zip)
+    return filename, payload
+
+
+def build_languages(langs, args):
+    """Yield ``(lang, (filename, payload), error)`` for each language as soon
+    as it is done. With ``args.jobs`` > 1, languages are built in parallel,
+    each in its own process; a failure doesn't stop the others.
+    With ``--addrelations``, several languages are relationized together
+    by ``build_languages_together``."""
+    if args.addrelations and len(langs) > 1 and not args.incremental:
+        yield from build_languages_together(langs, args)
+        return
+    jobs = min(args.jobs, len(langs))
+    if jobs <= 1:
+        for lang in langs:
+            try:
+                yield lang, build_language(lang, args), None
+            except Exception as err:
+                yield lang, None, err
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(build_language, lang, args): lang
+                   for lang in langs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as err:
+                yield futures[future], None, err
+
+
+def build_languages_together(langs, args):
+    """Create every language without relations, in parallel with
+    ``args.jobs`` > 1, then relationize them all in one pass sharing one
+    table of entries (see ``relationize.relationize_together``), and save
+    them. A language failing to be created is left out; the others are
+    still built."""
+    stage_args = argparse.Namespace(**vars(args))
+    stage_args.addrelations = stage_args.addbacklinks = False
+    results = {}
+    jobs = min(args.jobs, len(langs))
+    if jobs <= 1:
+        for lang in langs:
+            try:
+                results[lang] = create_dictionary(lang, stage_args)
+            except Exception as err:
+                results[lang] = err
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = {executor.submit(create_dictionary, lang, stage_args):
+                       lang for lang in langs}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as err:
+                    results[futures[future]] = err
+    created = []
+    for lang in langs:
+        if isinstance(results[lang], Exception):
+            yield lang, None, results[lang]
+        else:
+            created.append((lang, results[lang]))
+    if not created:
+        return
+    dictionaries = [dictionary for _, dictionary in created]
+    backlinks = [BacklinkIndex() for _ in created]
+    print('relationizing {}...'.format(", ".join(lang for lang, _ in created)))
+    start = time()
+    word_lists, mismatches = relationize.relationize_together(
+        dictionaries, args.relationize, backlinks)
+    print(" ({:.1f} sec.)".format(time() - start))
+    print_mismatches([lang for lang, _ in created], mismatches)
+    for (lang, dictionary), words, index in zip(created, word_lists,
+                                                backlinks):
+        dictionary.words = words
+        dictionary.backlinks = index
+        if args.addbacklinks:
+            relationize.add_backlinks(dictionary.words, dictionary.backlinks)
+        try:
+            yield lang, save_dictionary(lang, dictionary, args), None
+        except Exception as err:
+            yield lang, None, err
+
+
+def print_mismatches(langs, mismatches, limit=10):
+    """Report references to forms some of ``langs`` have no entry of."""
+    per_lang = defaultdict(list)
+    for (source, form, missing), count in mismatches.items():
+        per_lang[source].append((form, missing, count))
+    for source in sorted(per_lang):
+        found = sorted(per_lang[source], key=lambda found: (-found[2], found))
+        print("  {}: {} references resolve only in some languages."
+              .format(langs[source], sum(count for *_, count in found)))
+        for form, missing, count in found[:limit]:
+            print("    {{{}}} x{}: no entry in {}".format(
+                form, count, ", ".join(langs[i] for i in missing)))
+
+
+if __name__ == '__main__':
+    args = handle_commandline()
+    langs = args.language
+    failures = []
+
+    def built_members():
+        """Exits after the last language if any failed, so that an
+        unfinished zip file never replaces the old one."""
+        for lang, built, error in build_languages(langs, args):
+            if error is not None:
+                failures.append(lang)
+                print("Failed: {} ({}: {})."
+                      .format(lang, type(error).__name__, error))
+                continue
+            print("Done: {}.".format(lang))
+            filename, payload = built
+            yield filename if payload is None else (filename, payload)
+        print()
+        if failures:
+            sys.exit("Failed: {}.".format(", ".join(failures)))
+
     if args.zip:
+        # members are compressed as soon as each language is done.
         zipdealer = JbovlasteZipDealer(langs)
-        zipdealer.zippy()
+        zipdealer.zippy(built_members())
+    else:
+        for _ in built_members():
+            pass
     print("Success!")
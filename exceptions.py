@@ -19,3 +19,11 @@ class WordComponentsError(Exception):
 
 class NotOTMJson(Exception):
     ...
+
+
+class StaleIndex(Exception):
+    ...
+
+
+class PipelineError(Exception):
+    ...
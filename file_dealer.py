@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
+import hashlib
 import json
-import os.path
+import marshal
+import multiprocessing
+import os
+import re
+import struct
+import time
+import xml.etree.ElementTree as ElementTree
 import xmltodict
 import zipfile
+import zlib
+from collections import namedtuple, OrderedDict
 from exceptions import NotOTMJson
+from vlaste_builder import OTM_SCHEMA_VERSION, sidecar_filename
 
 
 class JbovlasteXmlDealer:
@@ -26,6 +37,27 @@ class JbovlasteXmlDealer:
             self.__has_dict = True
             return self.__jbodict, self.__nldict
 
+    def iter_valsi(self):
+        """Yield valsi one by one, in the same form as ``make_dict`` gives.
+        Only the first (jbo -> XXX) direction is read, and each element is
+        thrown away as soon as it is converted, so memory stays flat."""
+        xmlname = 'xml/jbo-{}-xml.xml'.format(self.__lang)
+        depth = 0
+        direction = None
+        with open(xmlname, 'rb') as f:
+            for event, elem in ElementTree.iterparse(f, ('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2:
+                        direction = elem
+                    continue
+                depth -= 1
+                if depth == 2 and elem.tag == 'valsi':
+                    yield _element_to_dict(elem)
+                    direction.remove(elem)
+                elif depth == 1:
+                    return
+
     def make_json(self):
         if self.__has_json:
             return self.__json
@@ -42,15 +74,174 @@ class JbovlasteXmlDealer:
             print("Saved json.")
 
 
+def _element_to_dict(elem):
+    """Convert an element into the value ``xmltodict.parse`` makes of it."""
+    item = {'@' + key: value for key, value in elem.attrib.items()}
+    texts = [elem.text] if elem.text else []
+    for child in elem:
+        value = _element_to_dict(child)
+        if child.tag not in item:
+            item[child.tag] = value
+        elif isinstance(item[child.tag], list):
+            item[child.tag].append(value)
+        else:
+            item[child.tag] = [item[child.tag], value]
+        if child.tail:
+            texts.append(child.tail)
+    text = ''.join(texts).strip() or None
+    if not item:
+        return text
+    if text is not None:
+        item['#text'] = text
+    return item
+
+
+def _arcname(filename):
+    """Member name of ``filename``, normalized as by
+    ``zipfile.ZipInfo.from_file``: no drive, no leading separators, and
+    "/" between the parts. Parts going up ("..") are dropped as well."""
+    filename = os.path.normpath(os.path.splitdrive(filename)[1])
+    if os.sep != '/':
+        filename = filename.replace(os.sep, '/')
+    if os.altsep and os.altsep != '/':
+        filename = filename.replace(os.altsep, '/')
+    return '/'.join(part for part in filename.split('/')
+                    if part not in ('', '.', '..'))
+
+
+_PackedMember = namedtuple("_PackedMember",
+                           "crc size date_time comment deflated")
+
+
 class ZipDealer:
-    def __init__(self, pathname):
+    """Pack members into a zip file.
+
+    Members are deflated in blocks by a thread pool (zlib releases the GIL),
+    each block primed with the 32KiB before it and sync-flushed, so the
+    blocks join into one deflate stream. The sha256 of each member is kept
+    as its comment; when the zip file is updated, a member with the same
+    hash is copied over from the old file without being recompressed."""
+    BLOCK_SIZE = 1 << 20
+    WINDOW_SIZE = 1 << 15
+    LOCAL = struct.Struct('<4sHHHHHIIIHH')
+    CENTRAL = struct.Struct('<4sHHHHHHIIIHHHHHII')
+    END = struct.Struct('<4sHHHHIIH')
+
+    def __init__(self, pathname, workers=None):
         self.__pathname = pathname
+        self.__workers = workers or os.cpu_count() or 1
 
-    def zippy(self, filenames):
-        with zipfile.ZipFile(self.__pathname, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for filename in filenames:
-                zf.write(filename)
-            print("Zipped: {}.".format(self.__pathname))
+    @property
+    def pathname(self):
+        return self.__pathname
+
+    def zippy(self, members):
+        """``members`` yields filenames, or ``(arcname, payload)`` pairs for
+        payloads already in memory. It may be a generator; each member is
+        compressed as soon as it is yielded."""
+        old_infos = self._old_infos()
+        packed = OrderedDict()
+        reused = 0
+        with concurrent.futures.ThreadPoolExecutor(self.__workers) as executor:
+            for member in members:
+                if isinstance(member, str):
+                    with open(member, 'rb') as f:
+                        arcname, payload = member, f.read()
+                else:
+                    arcname, payload = member
+                arcname = _arcname(arcname)
+                comment = 'sha256:{}'.format(
+                    hashlib.sha256(payload).hexdigest()).encode('ascii')
+                info = old_infos.get(arcname)
+                if info is not None and info.comment == comment:
+                    packed[arcname] = _PackedMember(
+                        info.CRC, info.file_size, info.date_time, comment,
+                        [self._old_deflated(info)])
+                    reused += 1
+                else:
+                    packed[arcname] = _PackedMember(
+                        zlib.crc32(payload), len(payload),
+                        time.localtime()[:6], comment,
+                        self._deflate(executor, payload))
+            tmpname = self.__pathname + '.tmp'
+            try:
+                with open(tmpname, 'wb') as f:
+                    self._write(f, self._ordered(packed))
+                os.replace(tmpname, self.__pathname)
+            finally:
+                if os.path.exists(tmpname):
+                    os.remove(tmpname)
+        print("Zipped: {} ({} compressed, {} reused)."
+              .format(self.__pathname, len(packed) - reused, reused))
+
+    def _ordered(self, packed):
+        """Members in the order they are written; as they came, by default."""
+        return list(packed.items())
+
+    def _old_infos(self):
+        if not os.path.exists(self.__pathname):
+            return {}
+        try:
+            with zipfile.ZipFile(self.__pathname) as zf:
+                return {info.filename: info for info in zf.infolist()
+                        if info.compress_type == zipfile.ZIP_DEFLATED}
+        except zipfile.BadZipFile:
+            return {}
+
+    def _old_deflated(self, info):
+        """Deflated bytes of a member of the current zip file, as they are."""
+        with open(self.__pathname, 'rb') as f:
+            f.seek(info.header_offset)
+            header = self.LOCAL.unpack(f.read(self.LOCAL.size))
+            f.seek(header[-2] + header[-1], os.SEEK_CUR)
+            return f.read(info.compress_size)
+
+    def _deflate(self, executor, payload):
+        view = memoryview(payload)
+        starts = range(0, len(payload), self.BLOCK_SIZE)
+        if not starts:
+            return [zlib.compress(b'', wbits=-zlib.MAX_WBITS)]
+        return [executor.submit(self._deflate_block, view, start,
+                                start + self.BLOCK_SIZE >= len(payload))
+                for start in starts]
+
+    @classmethod
+    def _deflate_block(cls, view, start, last):
+        window = view[max(0, start - cls.WINDOW_SIZE):start]
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                      zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zdict=window if start else b'')
+        block = compressor.compress(view[start:start + cls.BLOCK_SIZE])
+        return block + compressor.flush(zlib.Z_FINISH if last
+                                        else zlib.Z_SYNC_FLUSH)
+
+    def _write(self, f, packed):
+        central = []
+        for arcname, member in packed:
+            offset = f.tell()
+            name = arcname.encode('utf-8')
+            flags = 0 if name.isascii() else 0x800
+            year, month, day, hour, minute, second = member.date_time
+            dostime = hour << 11 | minute << 5 | second // 2
+            dosdate = (year - 1980) << 9 | month << 5 | day
+            deflated = b''.join(block if isinstance(block, bytes)
+                                else block.result()
+                                for block in member.deflated)
+            f.write(self.LOCAL.pack(b'PK\x03\x04', 20, flags, 8,
+                                    dostime, dosdate, member.crc,
+                                    len(deflated), member.size, len(name), 0))
+            f.write(name)
+            f.write(deflated)
+            central.append(self.CENTRAL.pack(
+                b'PK\x01\x02', 3 << 8 | 20, 20, flags, 8, dostime, dosdate,
+                member.crc, len(deflated), member.size, len(name), 0,
+                len(member.comment), 0, 0, 0o644 << 16, offset)
+                + name + member.comment)
+        start = f.tell()
+        for record in central:
+            f.write(record)
+        f.write(self.END.pack(b'PK\x05\x06', 0, 0, len(central),
+                              len(central), f.tell() - start, start, 0))
 
 
 class JbovlasteZipDealer(ZipDealer):
@@ -59,45 +250,239 @@ class JbovlasteZipDealer(ZipDealer):
         pathname = 'zip/{}-otmjson.zip'.format("-".join(langs))
         super().__init__(pathname)
 
-    def zippy(self):
-        filename_template = 'otm-json/jbo-{}_otm.json'
-        filenames = (filename_template.format(lang) for lang in self.langs)
-        super().zippy(filenames)
+    def zippy(self, members=None):
+        if members is None:
+            filename_template = 'otm-json/jbo-{}_otm.json'
+            members = (filename_template.format(lang) for lang in self.langs)
+        super().zippy(members)
+
+    def _ordered(self, packed):
+        """Members in the order of ``langs``, however they came."""
+        def lang_order(item):
+            for i, lang in enumerate(self.langs):
+                if item[0].endswith('jbo-{}_otm.json'.format(lang)):
+                    return i
+            return len(self.langs)
+        return sorted(packed.items(), key=lang_order)
 
 
 class RawdictDealer:
     def __init__(self, lang):
         self.__lang = lang
+        self.__cache = RawdictCache('xml/jbo-{}-xml.xml'.format(lang),
+                                    'cache/jbo-{}.bin'.format(lang))
 
     def load(self):
-        filename = 'json/jbo-{}.json'.format(self.__lang)
-        if os.path.exists(filename):
-            with open(filename, encoding='utf-8') as f:
-                rawdict = json.loads(f.read())
-                print("Loaded {}".format(filename))
+        return list(self.iter_load())
+
+    def iter_load(self):
+        """Yield valsi one by one.
+        If the cache is stale or missing, valsi are streamed straight from
+        the xml file and the cache is rebuilt while they pass through."""
+        if self.__cache.is_fresh():
+            yield from self.__cache.load()
+            print("Loaded {}".format(self.__cache.filename))
         else:
-            print("file '{}' doesn't exist. Generating from xml file."
-                  .format(filename))
+            print("cache '{}' is missing or stale. Streaming from xml file."
+                  .format(self.__cache.filename))
             xml_dealer = JbovlasteXmlDealer(self.__lang)
-            rawdict, _ = xml_dealer.make_dict()
-            print("OK, loaded.")
-            xml_dealer.save_json()
-        return rawdict
+            yield from self.__cache.write_through(xml_dealer.iter_valsi())
+            print("Saved {}".format(self.__cache.filename))
+
+
+class RawdictCache:
+    """Versioned binary cache of the valsi list read from an xml file.
+
+    The file is ``MAGIC``, a header describing the xml file (size, mtime
+    and sha256), then the valsi in length-prefixed chunks, all written
+    with ``marshal``: valsi are only dicts, lists and strings, and unlike
+    pickle, loading marshal data never calls anything. Equal strings are
+    shared inside a chunk, so repeated usernames, types and keys are
+    stored (and later allocated) only once. Loading is then about twice
+    as fast as ``json.load`` of the same valsi; most of what is left is
+    making the objects themselves.
+    When the xml file doesn't match the header, the cache is stale."""
+    MAGIC = b'JBVLCACHE'
+    VERSION = 2
+    MARSHAL_VERSION = 4
+    CHUNK_SIZE = 1000
+    FRAME = struct.Struct('<I')
+
+    def __init__(self, xmlname, filename):
+        self.xmlname = xmlname
+        self.filename = filename
+
+    def _read_header(self, f):
+        if f.read(len(self.MAGIC)) != self.MAGIC:
+            return None
+        try:
+            header = marshal.load(f)
+        except Exception:
+            return None
+        if not isinstance(header, dict):
+            return None
+        if header.get("version") != self.VERSION:
+            return None
+        return header
+
+    def is_fresh(self):
+        """Size decides first, then mtime, then (only if mtime differs)
+        the content hash, so an untouched xml file is never re-read."""
+        if not os.path.exists(self.filename):
+            return False
+        with open(self.filename, 'rb') as f:
+            header = self._read_header(f)
+        if header is None:
+            return False
+        stat = os.stat(self.xmlname)
+        if header["size"] != stat.st_size:
+            return False
+        if header["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        return header["sha256"] == _sha256(self.xmlname)
+
+    def load(self):
+        """Yield the cached valsi. Check ``is_fresh`` before."""
+        with open(self.filename, 'rb') as f:
+            self._read_header(f)
+            while True:
+                frame = f.read(self.FRAME.size)
+                if not frame:
+                    return
+                size, = self.FRAME.unpack(frame)
+                yield from marshal.loads(f.read(size))
+
+    def write_through(self, valsi_iter):
+        """Pass valsi through while writing them to the cache file.
+        The file is put in place only after all valsi have passed."""
+        stat = os.stat(self.xmlname)
+        header = {"version": self.VERSION,
+                  "size": stat.st_size,
+                  "mtime_ns": stat.st_mtime_ns,
+                  "sha256": _sha256(self.xmlname)}
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmpname = self.filename + '.tmp'
+        try:
+            with open(tmpname, 'wb') as f:
+                f.write(self.MAGIC)
+                marshal.dump(header, f, self.MARSHAL_VERSION)
+                chunk = []
+                for valsi in valsi_iter:
+                    chunk.append(valsi)
+                    yield valsi
+                    if len(chunk) == self.CHUNK_SIZE:
+                        self._write_chunk(f, chunk)
+                        chunk = []
+                if chunk:
+                    self._write_chunk(f, chunk)
+            os.replace(tmpname, self.filename)
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+    def _write_chunk(self, f, chunk):
+        blob = marshal.dumps(_share_strings(chunk, {}),
+                             self.MARSHAL_VERSION)
+        f.write(self.FRAME.pack(len(blob)))
+        f.write(blob)
+
+
+class BuildStateDealer:
+    """What the last build of a language made, kept for ``--incremental``.
+
+    Records map each definitionid to ``[valsi hash, built word, relations]``.
+    A state written under another ``signature`` (options or version of the
+    pipeline) is never handed out. Like ``RawdictCache``, the state is
+    written with ``marshal``, as plain dicts, lists and tuples."""
+    VERSION = 2
+    MARSHAL_VERSION = 4
+
+    def __init__(self, lang, directory='cache/'):
+        self.filename = directory + 'jbo-{}.state'.format(lang)
+
+    def load(self, signature):
+        if not os.path.exists(self.filename):
+            return {}
+        with open(self.filename, 'rb') as f:
+            try:
+                state = marshal.load(f)
+            except Exception:
+                return {}
+        if (not isinstance(state, dict) or
+                state.get("version") != self.VERSION or
+                state.get("signature") != signature):
+            return {}
+        return state["records"]
+
+    def save(self, signature, records):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        state = {"version": self.VERSION,
+                 "signature": signature,
+                 "records": _plain(records)}
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'wb') as f:
+            marshal.dump(state, f, self.MARSHAL_VERSION)
+        os.replace(tmpname, self.filename)
+
+
+def _plain(obj):
+    """Copy of ``obj`` with plain dicts for OrderedDicts and plain tuples
+    for namedtuples, as marshal takes nothing else."""
+    if isinstance(obj, dict):
+        return {key: _plain(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_plain(value) for value in obj]
+    if isinstance(obj, tuple):
+        return tuple(_plain(value) for value in obj)
+    return obj
+
+
+def _share_strings(obj, memo):
+    """Copy of ``obj`` where equal strings are the same object."""
+    if isinstance(obj, str):
+        return memo.setdefault(obj, obj)
+    if isinstance(obj, dict):
+        return {memo.setdefault(key, key): _share_strings(value, memo)
+                for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_share_strings(value, memo) for value in obj]
+    return obj
+
+
+def _sha256(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
 
 
 class OTMizedJsonDealer:
-    def load(self, filename):
+    def load(self, filename, collect=False, workers=1):
+        """Load and, unless its sidecar vouches for it, check the file.
+        With ``collect``, a broken file is loaded anyway and every
+        violation is left in ``violations`` (see ``_OTMChecker.check``);
+        with ``workers``, the words are checked by that many processes."""
         if not filename.endswith(".json"):
             raise ValueError("filename must ends with '.json'.")
         if not os.path.exists(filename):
             raise ValueError("{} doesn't exist.".format(filename))
-        with open(filename, encoding='utf-8') as f:
-            json_dict = json.loads(f.read())
-            print("Loaded.")
-        print("Checking..")
-        checker = _OTMChecker(json_dict)
-        checker.check()
-        print("OK: {}.".format(filename))
+        with open(filename, 'rb') as f:
+            data = f.read()
+        json_dict = json.loads(data.decode('utf-8'))
+        print("Loaded.")
+        self.violations = []
+        if _is_trusted(filename, hashlib.sha256(data).hexdigest()):
+            print("Trusted: {}.".format(filename))
+        else:
+            print("Checking..")
+            checker = _OTMChecker(json_dict)
+            self.violations = checker.check(collect, workers)
+            if self.violations:
+                print("{} violations: {}."
+                      .format(len(self.violations), filename))
+            else:
+                print("OK: {}.".format(filename))
         self.__json = json_dict
 
     @property
@@ -110,25 +495,188 @@ class OTMizedJsonDealer:
             raise err
         return self.__json
 
+    def iter_words(self, filename):
+        """Yield words of the file one by one, checking each of them,
+        without parsing the whole file at once.
+        The other members are found in ``metadata`` after the last word."""
+        if not os.path.exists(filename):
+            raise ValueError("{} doesn't exist.".format(filename))
+        checker = _OTMChecker({"words": []})
+        trusted = _is_trusted(filename)
+        self.__metadata = {}
+        has_words = False
+        position = 0
+        with open(filename, encoding='utf-8') as f:
+            for key, value in _OTMJsonReader(f).members():
+                if key == "words":
+                    has_words = True
+                    if not trusted:
+                        checker._word_check(value, position)
+                    position += 1
+                    yield value
+                else:
+                    self.__metadata[key] = value
+        if not has_words:
+            raise NotOTMJson("Not have words attribute.")
+
+    @property
+    def metadata(self):
+        return self.__metadata
+
+
+def _is_trusted(filename, digest=None):
+    """Whether ``filename`` is just as the builder saved it, according to
+    its sidecar. ``digest`` is the sha256 of the file, if already known."""
+    sidecar = sidecar_filename(filename)
+    if not os.path.exists(sidecar):
+        return False
+    with open(sidecar, encoding='utf-8') as f:
+        try:
+            check = json.load(f)
+        except ValueError:
+            return False
+    if (not isinstance(check, dict) or
+            check.get("schema") != OTM_SCHEMA_VERSION or
+            check.get("size") != os.path.getsize(filename)):
+        return False
+    if digest is None:
+        digest = _sha256(filename)
+    return check.get("sha256") == digest
+
 
 class JbovlasteOTMizedJsonDealer(OTMizedJsonDealer):
     def __init__(self, lang, directory='otm-json/'):
         self.__lang = lang
         self.__filename = directory + 'jbo-{}_otm.json'.format(self.__lang)
 
-    def load(self):
-        super().load(self.__filename)
+    def load(self, collect=False, workers=1):
+        super().load(self.__filename, collect, workers)
+
+    def iter_words(self):
+        return super().iter_words(self.__filename)
+
+
+# What a json number may go on with, if cut at the end of a chunk.
+_NUMBER_CHARS = re.compile(r'[0-9.eE+-]*')
+
+
+class _OTMJsonReader:
+    """Read the top-level object of an OTM-json file member by member,
+    and its ``words`` array item by item, with ``JSONDecoder.raw_decode``.
+    ``members`` yields ``("words", word)`` once for each word.
+
+    Values cut at any chunk boundary are read whole:
+
+    >>> import io
+    >>> text = '{"words": [2.5e10, -1, {"a": 0.5}], "x": 12}'
+    >>> expected = [("words", 2.5e10), ("words", -1),
+    ...             ("words", {"a": 0.5}), ("x", 12)]
+    >>> all(list(_OTMJsonReader(io.StringIO(text), size).members())
+    ...     == expected for size in range(1, len(text) + 1))
+    True
+    """
+    def __init__(self, f, chunk_size=1 << 16):
+        self.__f = f
+        self.__chunk_size = chunk_size
+        self.__buffer = ''
+        self.__pos = 0
+        self.__eof = False
+        self.__decoder = json.JSONDecoder()
+
+    def __fill(self):
+        chunk = self.__f.read(self.__chunk_size)
+        self.__buffer = self.__buffer[self.__pos:] + chunk
+        self.__pos = 0
+        self.__eof = not chunk
+
+    def __peek(self):
+        while True:
+            buffer = self.__buffer
+            while (self.__pos < len(buffer) and
+                   buffer[self.__pos] in ' \t\n\r'):
+                self.__pos += 1
+            if self.__pos < len(buffer):
+                return buffer[self.__pos]
+            if self.__eof:
+                return ''
+            self.__fill()
+
+    def __expect(self, chars):
+        char = self.__peek()
+        if not char or char not in chars:
+            raise NotOTMJson("expected one of '{}' at top level, got '{}'."
+                             .format(chars, char))
+        self.__pos += 1
+        return char
+
+    def __value(self):
+        self.__peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buffer,
+                                                       self.__pos)
+            except json.JSONDecodeError as err:
+                if self.__eof:
+                    raise NotOTMJson("broken json: {}".format(err))
+                self.__fill()
+                continue
+            # a number followed only by number characters up to the end of
+            # the buffer may go on in the next chunk ("2." of "2.5").
+            if (not self.__eof and isinstance(value, (int, float)) and
+                    _NUMBER_CHARS.match(self.__buffer, end).end() ==
+                    len(self.__buffer)):
+                self.__fill()
+                continue
+            self.__pos = end
+            return value
+
+    def members(self):
+        self.__expect('{')
+        if self.__peek() == '}':
+            return
+        while True:
+            key = self.__value()
+            self.__expect(':')
+            if key == "words":
+                self.__expect('[')
+                if self.__peek() == ']':
+                    self.__pos += 1
+                else:
+                    while True:
+                        yield key, self.__value()
+                        if self.__expect(',]') == ']':
+                            break
+            else:
+                yield key, self.__value()
+            if self.__expect(',}') == '}':
+                return
 
 
 class _OTMChecker():
-    """Should shorten and revise _XXX_check method. REDUNDUNT!"""
+    """Check that json_dict is OTM-json.
+
+    Each word goes through one pass of plain type and key checks; only a
+    word failing them is walked again to tell what is wrong with it.
+    ``check(collect=True)`` returns every violation as ``(position, word
+    id, message)`` instead of raising at the first one, and with
+    ``workers`` the words are checked in chunks by that many processes.
+    The word id is None when the entry itself is broken."""
+    CHUNK_SIZE = 5000
+
     def __init__(self, json_dict):
         self.json = json_dict
 
-    def check(self):
+    def check(self, collect=False, workers=1):
         self._words_check()
-        for word in self.json["words"]:
-            self._word_check(word)
+        words = self.json["words"]
+        if workers > 1 and len(words) > self.CHUNK_SIZE:
+            violations = _check_in_parallel(words, collect, workers,
+                                            self.CHUNK_SIZE)
+        else:
+            violations = _check_words(words, 0, len(words), collect)
+        if violations and not collect:
+            raise NotOTMJson(violations[0][2])
+        return violations
 
     def _words_check(self):
         if 'words' not in self.json.keys():
@@ -136,93 +684,155 @@ class _OTMChecker():
         if not isinstance(self.json["words"], list):
             raise NotOTMJson("words must be list")
 
-    def _word_check(self, word):
-        component_types = {"entry", "translations", "tags",
-                           "contents", "variations", "relations"}
-        if set(word) != component_types:
-            lacks = [comp_type for comp_type in component_types
-                     if comp_type not in list(word)]
-            raise NotOTMJson("Attributes lack: {}.".format(word))
-
-        self._entry_check(word)
-        self._translations_check(word)
-        self._tags_check(word)
-        self._contents_check(word)
-        self._variations_check(word)
-        self._relations_check(word)
-
-    def _entry_check(self, word):
-        ok = True
-        if set(word["entry"]) != {"id", "form"}:
-            raise NotOTMJson("Entry is broken: {}.".format(word))
-        if not isinstance(word["entry"]["id"], int):
-            ok = False
-        if not isinstance(word["entry"]["form"], str):
-            ok = False
-        if not ok:
-            raise NotOTMJson("Entry is broken: {}.".format(word))
-
-    def __word_components_check(self, word, name, component_attrs, attr_type):
-        err_message = "{} is broken: {}.".format(name, word)
-        if not isinstance(word[name], list):
-            raise NotOTMJson(err_message)
-        for component in word[name]:
-            err_message_2 = ("{} is broken: {} in {}."
-                             .format(name[:-1], component, word))
-            ok = True
-            if set(component) != set(component_attrs):
-                raise NotOTMJson(err_message)
-            if not isinstance(component["title"], str):
-                ok = False
-            attr = [x for x in component_attrs if x != "title"][0]
-            if not isinstance(component[attr], attr_type):
-                ok = False
-            if not ok:
-                raise NotOTMJson(err_message_2)
-
-    def _translations_check(self, word):
-        self.__word_components_check(word, "translations",
-                                     {"title", "forms"}, list)
-        for component in word["translations"]:
-            ok = True
-            for form in component["forms"]:
-                if not isinstance(form, str):
-                    ok = False
-            if not ok:
-                raise NotOTMJson("form is broken: {} in {}."
-                                 .format(form, word))
-
-    def _contents_check(self, word):
-        self.__word_components_check(word, "contents",
-                                     {"title", "text"}, str)
-
-    def _variations_check(self, word):
-        self.__word_components_check(word, "variations",
-                                     {"title", "form"}, str)
-
-    def _relations_check(self, word):
-        self.__word_components_check(word, "relations",
-                                     {"title", "entry"}, dict)
-        for component in word["relations"]:
-            ok = True
-            try:
-                self._entry_check(component)
-            except NotOTMJson:
-                ok = False
-            if not ok:
-                raise NotOTMJson("entry in relation is broken: {} in {}"
-                                 .format(component, word))
-
-    def _tags_check(self, word):
-        name = "tags"
-        err_message = "{} is broken: {}.".format(name, word)
+    def _word_check(self, word, position):
+        if not _word_is_valid(word):
+            raise NotOTMJson(_word_violations(word, position)[0][2])
+
+
+_WORD_KEYS = frozenset(("entry", "translations", "tags",
+                        "contents", "variations", "relations"))
+_ENTRY_KEYS = frozenset(("id", "form"))
+# name: (keys, attribute besides title, type of the attribute)
+_COMPONENTS = {"translations": (frozenset(("title", "forms")), "forms", list),
+               "contents": (frozenset(("title", "text")), "text", str),
+               "variations": (frozenset(("title", "form")), "form", str),
+               "relations": (frozenset(("title", "entry")), "entry", dict)}
+
+
+def _entry_is_valid(entry):
+    return (isinstance(entry, dict) and entry.keys() == _ENTRY_KEYS and
+            isinstance(entry["id"], int) and isinstance(entry["form"], str))
+
+
+def _word_is_valid(word):
+    if not isinstance(word, dict) or word.keys() != _WORD_KEYS:
+        return False
+    if not _entry_is_valid(word["entry"]):
+        return False
+    tags = word["tags"]
+    if not isinstance(tags, list):
+        return False
+    for tag in tags:
+        if not isinstance(tag, str):
+            return False
+    for name, (keys, attr, attr_type) in _COMPONENTS.items():
+        components = word[name]
+        if not isinstance(components, list):
+            return False
+        for component in components:
+            if (not isinstance(component, dict) or component.keys() != keys or
+                    not isinstance(component["title"], str) or
+                    not isinstance(component[attr], attr_type)):
+                return False
+    for translation in word["translations"]:
+        for form in translation["forms"]:
+            if not isinstance(form, str):
+                return False
+    for relation in word["relations"]:
+        if not _entry_is_valid(relation["entry"]):
+            return False
+    return True
+
+
+def _word_violations(word, position):
+    """Every violation in the word at ``position`` as ``(position, word
+    id, message)``. A word whose entry is broken is told by its position,
+    and its id is None."""
+    if isinstance(word, dict) and _entry_is_valid(word.get("entry")):
+        id_ = word["entry"]["id"]
+        label = "word {}".format(id_)
+    else:
+        id_ = None
+        label = "word at {}".format(position)
+    messages = []
+    if not isinstance(word, dict):
+        return [(position, id_,
+                 "word must be object: {}. ({})".format(word, label))]
+    if word.keys() != _WORD_KEYS:
+        lacks = sorted(_WORD_KEYS - word.keys())
+        extras = sorted(word.keys() - _WORD_KEYS)
+        messages.append("Attributes lack: {}, extra: {}."
+                        .format(lacks, extras))
+    if "entry" in word and not _entry_is_valid(word["entry"]):
+        messages.append("Entry is broken: {}.".format(word["entry"]))
+    if "tags" in word:
+        if not isinstance(word["tags"], list):
+            messages.append("tags is broken: {}.".format(word["tags"]))
+        else:
+            messages.extend("name is broken: {}.".format(tag)
+                            for tag in word["tags"]
+                            if not isinstance(tag, str))
+    for name, (keys, attr, attr_type) in _COMPONENTS.items():
+        if name not in word:
+            continue
         if not isinstance(word[name], list):
-            raise NotOTMJson(err_message)
+            messages.append("{} is broken: {}.".format(name, word[name]))
+            continue
         for component in word[name]:
-            ok = True
-            err_message_2 = ("name is broken: {} in {}."
-                             .format(component, word))
-            if not isinstance(component, str):
-                ok = False
-            if not ok:
-                raise NotOTMJson(err_message_2)
+            if (not isinstance(component, dict) or
+                    component.keys() != keys or
+                    not isinstance(component["title"], str) or
+                    not isinstance(component[attr], attr_type)):
+                messages.append("{} is broken: {}."
+                                .format(name[:-1], component))
+            elif name == "translations":
+                messages.extend("form is broken: {}.".format(form)
+                                for form in component["forms"]
+                                if not isinstance(form, str))
+            elif name == "relations" and not _entry_is_valid(
+                    component["entry"]):
+                messages.append("entry in relation is broken: {}."
+                                .format(component))
+    if not messages:
+        messages.append("word is broken: {}.".format(word))
+    return [(position, id_, "{} ({})".format(message, label))
+            for message in messages]
+
+
+def _check_words(words, start, end, collect, offset=0):
+    """Violations of ``words[start:end]``, the words being at ``offset``
+    in the whole list."""
+    violations = []
+    for i in range(start, end):
+        if not _word_is_valid(words[i]):
+            violations.extend(_word_violations(words[i], offset + i))
+            if not collect:
+                break
+    return violations
+
+
+_words_to_check = None
+
+
+def _check_chunk(start, end, collect):
+    return _check_words(_words_to_check, start, end, collect)
+
+
+def _check_in_parallel(words, collect, workers, chunk_size):
+    """Forked workers see ``words`` without it being pickled to them;
+    without fork, each chunk is sent along with its task."""
+    global _words_to_check
+    ranges = [(start, min(start + chunk_size, len(words)))
+              for start in range(0, len(words), chunk_size)]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _words_to_check = words
+        context = multiprocessing.get_context('fork')
+        tasks = [(_check_chunk, start, end, collect)
+                 for start, end in ranges]
+    else:
+        context = None
+        tasks = [(_check_words, words[start:end], 0, end - start, collect,
+                  start)
+                 for start, end in ranges]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=context) as executor:
+            futures = [executor.submit(*task) for task in tasks]
+            violations = []
+            for future in futures:
+                violations.extend(future.result())
+                if violations and not collect:
+                    break
+    finally:
+        _words_to_check = None
+    return violations
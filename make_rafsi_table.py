@@ -3,7 +3,7 @@ import csv
 import re
 from collections import defaultdict
 
-from vlaste_builder import JbovlasteDictionaryBuilder
+from vlaste_builder import JbovlasteWordBuilder, LazyDictionaryBuilder
 from vlaste_manager import DictionaryManager
 from file_dealer import JbovlasteOTMizedJsonDealer
 
@@ -21,7 +21,7 @@ def rafsi_collector(dictionaries):
                 estimated_rafsis = rafsi_detector(word)
                 if estimated_rafsis:
                     rafsi_table[key].update(estimated_rafsis)
-            if 'rafsi' in word.contents.keys():
+            if word.contents.has('rafsi'):
                 rafsi_set = word.contents.find('rafsi')[1].text.split()
                 rafsi_table[key].update(rafsi_set)
     return rafsi_table
@@ -38,7 +38,7 @@ def rafsi_detector(word):
         result = MANUAL_WORDS[word.entry.form]
         print("MANUALLY detect in {}: '{}'".format(word.entry.form, result))
         return result
-    if 'notes' in word.contents.keys():
+    if word.contents.has('notes'):
         key_phrase = r'([pP]roposed |[sS]hort |[pP]roposed [sS]hort )rafsi'
         notes_text = word.contents.find('notes')[1].text
         match_ = re.search(key_phrase, notes_text)
@@ -72,6 +72,12 @@ def rafsi_detector(word):
         return []
 
 
+def may_have_rafsi(word):
+    """Whether rafsi_collector can find rafsi in a raw OTM-json word."""
+    return ('unofficial' in word["tags"] or
+            any(content["title"] == 'rafsi' for content in word["contents"]))
+
+
 def sort_key(row):
     word = row[0]
     if word[0] == '*':
@@ -88,7 +94,9 @@ def make_rafsi_table(format="csv"):
     else:
         raise ValueError("not supported.")
     en_dealer = JbovlasteOTMizedJsonDealer("en")
-    en_dictionary = JbovlasteDictionaryBuilder.load(en_dealer.json)
+    en_words = filter(may_have_rafsi, en_dealer.iter_words())
+    en_dictionary = LazyDictionaryBuilder.load({"words": en_words},
+                                               builder=JbovlasteWordBuilder)
     en_manager = DictionaryManager(en_dictionary)
     rafsi_dict = rafsi_collector((en_dictionary,)).items()
     rafsi_table = [[key, *rafsis] for key, rafsis in rafsi_dict]
@@ -0,0 +1,206 @@
+# coding=utf-8
+import concurrent.futures
+import os
+import pickle
+from collections import namedtuple, OrderedDict
+from time import perf_counter
+
+from exceptions import PipelineError
+
+Stage = namedtuple("Stage", "name func requires enabled per_word")
+StageReport = namedtuple("StageReport", "name seconds touched")
+
+# Words run in the parent and timed before choosing whether to use a pool.
+SAMPLE_SIZE = 200
+# Work shorter than this many seconds is never worth starting workers for.
+MEASURE_SECONDS = 0.05
+# Seconds to start one worker of each kind, measured once per process.
+_startup = {}
+
+
+class Pipeline:
+    """Stages transforming a dictionary, run in the order of their
+    dependencies.
+
+    A word stage is ``func(word, context)`` returning whether it changed
+    the word; consecutive word stages are fused into one pass over the
+    words, which may be split into chunks run in parallel.
+    A dictionary stage is ``func(dictionary, context)`` returning how many
+    words it changed. ``enabled(context)`` tells whether a stage runs.
+
+    Reported seconds are wall time; the wall time of a fused pass is split
+    between its stages by the time each took on the words."""
+
+    def __init__(self):
+        self.__stages = OrderedDict()
+
+    def word_stage(self, name, requires=(), enabled=None):
+        return self.__register(name, requires, enabled, True)
+
+    def dictionary_stage(self, name, requires=(), enabled=None):
+        return self.__register(name, requires, enabled, False)
+
+    def __register(self, name, requires, enabled, per_word):
+        if name in self.__stages:
+            raise PipelineError("stage '{}' is already registered."
+                                .format(name))
+
+        def register(func):
+            self.__stages[name] = Stage(name, func, tuple(requires),
+                                        enabled, per_word)
+            return func
+        return register
+
+    def ordered(self):
+        """Stages with each one after those it requires, and otherwise
+        in the order they were registered."""
+        done = OrderedDict()
+
+        def visit(name, path):
+            if name in done:
+                return
+            if name in path:
+                raise PipelineError("stages depend on each other: {}"
+                                    .format(" -> ".join(path + (name,))))
+            if name not in self.__stages:
+                raise PipelineError("stage '{}' is required by '{}' "
+                                    "but not registered."
+                                    .format(name, path[-1]))
+            for required in self.__stages[name].requires:
+                visit(required, path + (name,))
+            done[name] = self.__stages[name]
+
+        for name in self.__stages:
+            visit(name, ())
+        return list(done.values())
+
+    def passes(self, context):
+        """Enabled stages, as lists of fused word stages
+        and single dictionary stages."""
+        passes = []
+        for stage in self.ordered():
+            if stage.enabled is not None and not stage.enabled(context):
+                continue
+            if stage.per_word and passes and passes[-1][0].per_word:
+                passes[-1].append(stage)
+            else:
+                passes.append([stage])
+        return passes
+
+    def run_word(self, word, context):
+        """Run the enabled word stages on one word."""
+        for stages in self.passes(context):
+            if stages[0].per_word:
+                _run_words([word], [stage.func for stage in stages], context)
+        return word
+
+    def run(self, dictionary, context, jobs=1, chunk_size=500):
+        """Run every enabled stage on ``dictionary``.
+        Returns a StageReport for each stage run."""
+        reports = []
+        for stages in self.passes(context):
+            if stages[0].per_word:
+                reports.extend(self.__run_word_pass(
+                    dictionary, stages, context, jobs, chunk_size))
+            else:
+                stage = stages[0]
+                start = perf_counter()
+                touched = stage.func(dictionary, context)
+                reports.append(StageReport(stage.name,
+                                           perf_counter() - start, touched))
+        return reports
+
+    @staticmethod
+    def __run_word_pass(dictionary, stages, context, jobs, chunk_size):
+        """With ``jobs`` > 1, the first SAMPLE_SIZE words are run and timed
+        in the parent first; the rest go to a pool of ``jobs`` processes
+        only if sending the words there and back is paid for."""
+        started = perf_counter()
+        words = dictionary.words
+        funcs = [stage.func for stage in stages]
+        sample = len(words) if jobs <= 1 else min(SAMPLE_SIZE, len(words))
+        chunks = [_run_words(words[:sample], funcs, context)]
+        rest = words[sample:]
+        if rest:
+            cost = (perf_counter() - started) / sample
+            if _pays_for_pool(words[:sample], cost, len(rest), jobs):
+                # words are sent to and back from the workers,
+                # so the result replaces the words of ``dictionary``.
+                starts = range(0, len(rest), chunk_size)
+                with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+                    chunks.extend(executor.map(
+                        _run_words,
+                        (rest[i:i + chunk_size] for i in starts),
+                        [funcs] * len(starts), [context] * len(starts)))
+                dictionary.words = [word for chunk in chunks
+                                    for word in chunk[0]]
+            else:
+                chunks.append(_run_words(rest, funcs, context))
+        wall = perf_counter() - started
+        seconds = [0.0] * len(stages)
+        touched = [0] * len(stages)
+        for _, chunk_seconds, chunk_touched in chunks:
+            for i in range(len(stages)):
+                seconds[i] += chunk_seconds[i]
+                touched[i] += chunk_touched[i]
+        total = sum(seconds)
+        return [StageReport(stage.name,
+                            wall * (seconds[i] / total if total
+                                    else 1 / len(stages)),
+                            touched[i])
+                for i, stage in enumerate(stages)]
+
+
+def _pays_for_pool(sample, cost, remaining, jobs):
+    """Whether ``remaining`` words taking ``cost`` seconds each are done
+    sooner by ``jobs`` processes. Each word is pickled to a worker and
+    back, which both the parent and the worker pay for; the time of that
+    is taken from the ``sample`` words. No more than ``os.cpu_count()``
+    of the workers are counted as running at once."""
+    serial = cost * remaining
+    running = min(jobs, os.cpu_count() or 1)
+    if serial < MEASURE_SECONDS or running <= 1:
+        return False
+    start = perf_counter()
+    pickle.loads(pickle.dumps(sample, pickle.HIGHEST_PROTOCOL))
+    transfer = 2 * (perf_counter() - start) / len(sample)
+    if transfer * remaining >= serial:
+        return False
+    parallel = (worker_startup("process") * jobs + transfer * remaining +
+                (cost + transfer) * remaining / running)
+    return parallel < serial
+
+
+def worker_startup(kind):
+    """Seconds to start one worker, "process" or "thread", timed once per
+    process by starting a pool of one and waiting for a no-op task."""
+    if kind not in _startup:
+        if kind == "thread":
+            executor = concurrent.futures.ThreadPoolExecutor(1)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(1)
+        start = perf_counter()
+        with executor:
+            executor.submit(os.getpid).result()
+        _startup[kind] = perf_counter() - start
+    return _startup[kind]
+
+
+def _run_words(words, funcs, context):
+    """One pass of the stage functions ``funcs`` over ``words``.
+    Returns the words with the seconds and changed words of each stage."""
+    seconds = [0.0] * len(funcs)
+    touched = [0] * len(funcs)
+    for word in words:
+        for i, func in enumerate(funcs):
+            start = perf_counter()
+            if func(word, context):
+                touched[i] += 1
+            seconds[i] += perf_counter() - start
+    return words, seconds, touched
+
+
+def print_reports(reports):
+    for report in reports:
+        print("  {}: {:.2f} sec., {} words".format(report.name, report.seconds,
+                                                  report.touched))
@@ -1,26 +1,28 @@
 # coding=utf-8
 import concurrent.futures
-import multiprocessing
-import re
+import math
+import os
 import sys
-from multiprocessing import cpu_count
-from collections import defaultdict
+from bisect import bisect_right
+from collections import Counter
+from time import perf_counter
 
+from pipeline import MEASURE_SECONDS, worker_startup
+from vlaste_index import EntryIndex, SharedEntryIndex, ids_by_form
+from vlaste_references import field_texts, scan, scan_texts
+
+# Title of the relations added by ``add_backlinks``.
+BACKLINK_TITLE = "referenced by"
+MODES = ("auto", "serial", "thread", "process")
+# Words timed in the parent before choosing how to run the rest.
+SAMPLE_SIZE = 200
+# Seconds each chunk should take; keeps workers busy but balanced.
+CHUNK_SECONDS = 0.05
 
-def default_prepare(dictionary):
-    entry_list = [word.entry for word in dictionary.words]
-    letters = ".abcdefgijklmnoprstuvxyz"
-    letters += letters[1:].upper()
-    entries_for_dict_creation = entry_list
-    entry_dict = defaultdict(set)
-    for letter in letters:
-        for i, entry in enumerate(entries_for_dict_creation):
-            if entry.form[0] == letter:
-                entry_dict[letter].add(entry)
-    for key, value in entry_dict.items():
-        entry_dict[key] = frozenset(value)
 
-    return entry_dict
+def default_prepare(dictionary):
+    """form → Entry の索引を返す。"""
+    return EntryIndex.from_dictionary(dictionary)
 
 
 def progress_print(now, max_size, cpu):
@@ -29,117 +31,232 @@ def progress_print(now, max_size, cpu):
     sys.stdout.flush()
 
 
-def default_relationize(dictionary):
-    entry_dict = default_prepare(dictionary)
-    max_task = len(dictionary.words)
-    results = set()
-
-    if max_task < 6000:
-        return single_relationize(entry_dict, dictionary)
-
-    cpu = cpu_count()
-    futures = set()
-    list_size = 2000
-    split_words = [dictionary.words[x:x+list_size]
-                   for x in range(0, max_task, list_size)]
-    with concurrent.futures.ProcessPoolExecutor(max_workers=cpu) as executor:
-        for words in split_words:
-            future = executor.submit(bulk_worker, words, entry_dict)
-            futures.add(future)
-        progress_print(0, max_task, cpu)
-        for future in concurrent.futures.as_completed(futures):
-            for word in future.result():
-                results.add(word)
-            done_task = len(results)
-            progress_print(done_task, max_task, cpu)
-
-    results = sorted(list(results), key=(lambda word: word.entry.form))
-
-    assert(len(results) == len(dictionary.words))
-    return results
-
-
-def nightly_relationize(dictionary):
-    entry_dict = default_prepare(dictionary)
-    jobs = multiprocessing.JoinableQueue()
-    results = multiprocessing.Queue()
-    errors = multiprocessing.Queue()
-    concurrency = cpu_count()
-    for word in dictionary.words:
-        jobs.put(word)
-    max_task = jobs.qsize()
-    print(max_task)
-
-    for _ in range(concurrency):
-        process = multiprocessing.Process(target=worker,
-                                          args=(entry_dict, jobs,
-                                                results, errors))
-        process.daemon = True
-        process.start()
-
-    word_list = set()
-    progress_print(0, max_task, concurrency)
-    while (len(word_list) + errors.qsize()) < max_task:
-        word = results.get()
-        word_list.add(word)
-        progress_print(len(word_list), max_task, concurrency)
-
-    if errors.qsize() > 0:
-        while not errors.empty():
-            err = errors.get_nowait()
-            print(err)
-
-    assert(errors.empty())
-    assert(len(word_list) == max_task)
-    return sorted(list(word_list), key=(lambda word: word.entry.form))
-
-
-def single_relationize(entry_dict, dictionary):
-    max_task = len(dictionary.words)
-    results = set()
-    progress_print(0, max_task, 1)
-    for word in dictionary.words:
-        results.add(_worker(word, entry_dict))
-        progress_print(len(results), max_task, 1)
-    return sorted(list(results), key=(lambda word: word.entry.form))
+def relationize(dictionary, mode="auto", backlinks=None, workers=None):
+    """全単語の notes と「関連語」にある {word} を relations に加え、
+    元の順のままの単語のリストを返す。各 chunk の結果は単語の番号で
+    元の位置に戻すので、worker の数や終わった順によらず結果は同じになる。
+
+    ``mode`` は "serial", "thread", "process" か "auto"。"auto" では最初の
+    SAMPLE_SIZE 語を親プロセスで処理して一語あたりの時間を測り、残りを
+    直列で処理するより worker の起動を含めて速くなる場合だけ並列にする。
+    ``backlinks`` に BacklinkIndex を渡すと、同時に逆引きも記録する。"""
+    word_lists, _ = relationize_together([dictionary], mode, [backlinks],
+                                         workers)
+    return word_lists[0]
 
 
-def worker(entry_dict, jobs, results, errors):
-    while True:
-        try:
-            word = jobs.get()
+def relationize_together(dictionaries, mode="auto", backlinks=None,
+                         workers=None):
+    """複数の言語の辞書を relationize と同じようにまとめて処理する。
+    form → 言語ごとの id の表を全言語の単語から一度に作り、全言語の単語を
+    一続きの job として chunk に分けるので、worker の起動も一度で済む。
+    参照は各言語の中で解決する。
+
+    各辞書の単語リストと、参照元の言語では解決できるが別の言語では
+    解決できない（またはその逆の）参照を数えた Counter
+    ``{(参照元の言語の番号, form, 解決できない言語の番号の tuple): 回数}``
+    を返す。``backlinks`` は辞書ごとの BacklinkIndex（か None）のリスト。"""
+    if mode not in MODES:
+        raise ValueError("mode must be one of {}.".format(", ".join(MODES)))
+    if backlinks is None:
+        backlinks = [None] * len(dictionaries)
+    word_lists = [list(dictionary.words) for dictionary in dictionaries]
+    bounds = [0]
+    for word_list in word_lists:
+        bounds.append(bounds[-1] + len(word_list))
+    words = [word for word_list in word_lists for word in word_list]
+    table = ids_by_form([word.entry for word in word_list]
+                        for word_list in word_lists)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    max_task = len(words)
+    mismatches = Counter()
+
+    def merge(result):
+        deltas, found = result
+        apply_deltas(words, deltas, bounds, backlinks)
+        mismatches.update(found)
+
+    ids_of = table.get
+    progress_print(0, max_task, 1)
+    done_task = 0
+    if mode != "serial" and workers > 1:
+        done_task = min(SAMPLE_SIZE, max_task)
+        start = perf_counter()
+        merge(resolved_deltas(texts_of(words, 0, done_task), ids_of, bounds))
+        cost = (perf_counter() - start) / max(done_task, 1)
+        if mode == "auto":
+            mode = choose_mode(cost, max_task - done_task, workers)
+    if mode == "serial" or workers <= 1 or done_task == max_task:
+        merge(resolved_deltas(texts_of(words, done_task, max_task), ids_of,
+                              bounds))
+        progress_print(max_task, max_task, 1)
+        return word_lists, mismatches
+
+    chunk_size = choose_chunk_size(cost, max_task - done_task, workers)
+    index = None
+    if mode == "thread":
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+        work, resolver = resolved_deltas, ids_of
+    else:
+        index = SharedEntryIndex.create(table, len(word_lists))
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+        work, resolver = delta_worker, index.name
+    try:
+        with executor:
             try:
-                result = _worker(word, entry_dict)
-                results.put(result)
-            except Exception as err:
-                errors.put(err)
-        finally:
-            jobs.task_done()
+                futures = {}
+                for start in range(done_task, max_task, chunk_size):
+                    end = min(start + chunk_size, max_task)
+                    future = executor.submit(work, texts_of(words, start, end),
+                                             resolver, bounds)
+                    futures[future] = end - start
+                progress_print(done_task, max_task, workers)
+                for future in concurrent.futures.as_completed(futures):
+                    merge(future.result())
+                    done_task += futures[future]
+                    progress_print(done_task, max_task, workers)
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+    finally:
+        if index is not None:
+            index.unlink()
+    return word_lists, mismatches
 
 
-def _worker(word, entry_dict):
-    """r"{[a-zA-Z']}" に該当する単語のうち、エントリーのあるものだけを relations に加える。
-    "ja" の場合「関連語」も対象にする。"""
-    regex = r"\{[.a-zA-Z']+\}"
-    potential_list = []
-    if "notes" in word.contents.keys():
-        potential_list.extend(re.findall(regex,
-                                         word.contents.find("notes")[1].text))
-    if "関連語" in word.contents.keys():
-        potential_list.extend(re.findall(regex,
-                                         word.contents.find("関連語")[1].text))
-    regex = "|".join([r'^[^.a-zA-Z]+', r'[^.a-zA-Z]+$'])
-    potential_list = [re.sub(regex, '', w) for w in potential_list]
-    for potential_word in potential_list:
-        for entry in entry_dict[potential_word[0]]:
-            if entry.form == potential_word:
+def choose_mode(cost, remaining, workers):
+    """一語あたり ``cost`` 秒の単語が ``remaining`` 語あるとき、
+    一番早く終わりそうな mode を返す。thread は GIL のない Python でだけ
+    速くなりうるので、その場合だけ候補にする。worker の起動時間は
+    pipeline.worker_startup で実際に測るが、直列でも MEASURE_SECONDS に
+    満たない場合は測らずに直列にする。"""
+    serial = cost * remaining
+    if serial < MEASURE_SECONDS:
+        return "serial"
+    estimates = {"serial": serial,
+                 "process": (worker_startup("process") * workers +
+                             serial / workers)}
+    if not getattr(sys, "_is_gil_enabled", lambda: True)():
+        estimates["thread"] = (worker_startup("thread") * workers +
+                               serial / workers)
+    return min(estimates, key=estimates.get)
+
+
+def choose_chunk_size(cost, remaining, workers):
+    """一つの chunk が CHUNK_SECONDS 秒ほどで済み、
+    かつ各 worker に四つ以上ずつ行き渡る大きさ。"""
+    by_time = int(CHUNK_SECONDS / max(cost, 1e-9))
+    by_balance = math.ceil(remaining / (workers * 4))
+    return max(1, min(by_time, by_balance))
+
+
+def default_relationize(dictionary, backlinks=None):
+    return relationize(dictionary, "auto", backlinks)
+
+
+def nightly_relationize(dictionary, backlinks=None):
+    return relationize(dictionary, "process", backlinks)
+
+
+def single_relationize(entry_dict, dictionary, backlinks=None):
+    """全単語の references を一度に取り出してから relations に加える。"""
+    words = list(dictionary.words)
+    max_task = len(words)
+    progress_print(0, max_task, 1)
+    # keyed by word position, since adjacent words may share an entry id.
+    references = scan_texts(texts_of(words, 0, max_task))
+    k = 0
+    for done, word in enumerate(words, 1):
+        while k < len(references) and references[k].source == done - 1:
+            entry = entry_dict.exact(references[k].form)
+            if entry is not None:
                 word.add_relation("", *entry)
-                break
-    return word
+                if backlinks is not None:
+                    backlinks.add(entry.id, done - 1, word.entry)
+            k += 1
+        if done % 1000 == 0 or done == max_task:
+            progress_print(done, max_task, 1)
+    return words
+
+
+def texts_of(words, start, end):
+    """words[start:end] の notes と「関連語」を
+    ``(単語の番号, field, text)`` のリストにする。worker にはこれだけを送る。"""
+    texts = []
+    for i in range(start, min(end, len(words))):
+        for _, field, text in field_texts((words[i],)):
+            texts.append((i, field, text))
+    return texts
+
+
+def resolved_deltas(texts, ids_of, bounds):
+    """texts_of の texts の references を ``ids_of`` (form → 言語ごとの id
+    の tuple か None) で、単語の番号から ``bounds`` で分かる言語の中で解決する。
+    ``(単語の番号, 関連語の id, 関連語の form)`` のリストと、言語によって
+    解決できたりできなかったりした参照の
+    ``(参照元の言語の番号, form, 解決できない言語の番号の tuple)`` のリストを返す。"""
+    deltas = []
+    mismatches = []
+    for reference in scan_texts(texts):
+        ids = ids_of(reference.form)
+        if ids is None:
+            continue
+        lang = bisect_right(bounds, reference.source) - 1
+        if ids[lang] is not None:
+            deltas.append((reference.source, ids[lang], reference.form))
+        if None in ids:
+            mismatches.append((lang, reference.form,
+                               tuple(i for i, id_ in enumerate(ids)
+                                     if id_ is None)))
+    return deltas, mismatches
+
+
+# 各 worker process で一度だけ共有メモリの索引に attach する。
+_attached = {}
+
+
+def delta_worker(texts, index_name, bounds):
+    """共有メモリの索引で resolved_deltas を行う、worker process 用。"""
+    index = _attached.get(index_name)
+    if index is None:
+        index = _attached[index_name] = SharedEntryIndex.attach(index_name)
+    return resolved_deltas(texts, index.ids_of, bounds)
 
 
-def bulk_worker(words, entry_dict):
-    result = []
+def apply_deltas(words, deltas, bounds, backlinks):
+    """deltas を words に加える。``backlinks`` は言語ごとの BacklinkIndex
+    （か None）で、単語の番号はその言語の中での番号にして記録する。"""
+    for i, id_, form in deltas:
+        words[i].add_relation("", id_, form)
+        lang = bisect_right(bounds, i) - 1
+        if backlinks[lang] is not None:
+            backlinks[lang].add(id_, i - bounds[lang], words[i].entry)
+
+
+def add_backlinks(words, backlinks):
+    """逆引きを BACKLINK_TITLE の relations として各単語に加える。
+    加えた単語の数を返す。"""
+    touched = 0
     for word in words:
-        result.append(_worker(word, entry_dict))
-    return result
+        sources = backlinks.sources(word.entry.id)
+        for source in sources:
+            word.add_relation(BACKLINK_TITLE, *source)
+        touched += bool(sources)
+    return touched
+
+
+def references(word):
+    """r"{[a-zA-Z']}" に該当する単語を、括弧を外して出現順に返す。
+    "ja" の場合「関連語」も対象にする。"""
+    return [reference.form for reference in scan((word,))]
+
+
+def _worker(word, entry_dict):
+    """references のうち、エントリーのあるものだけを relations に加える。
+    ``entry_dict`` は default_prepare の返す EntryIndex。"""
+    for potential_word in references(word):
+        entry = entry_dict.exact(potential_word)
+        if entry is not None:
+            word.add_relation("", *entry)
+    return word
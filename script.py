@@ -20,9 +20,11 @@ for _ in range(20):
 print(list(manager.filter_by_spell(".onji"))[0].keywords())
 
 def make_leven_dict():
+    gismu_liste = [word.entry.form
+                   for word in manager.filter_by_morphology("gismu")]
+    neighbors = manager.levenshtein_neighbors(gismu_liste, 1)
     leven_dict = defaultdict(list)
     for gismu in gismu_liste:
-        gismu = gismu.entry.form
-        levens = [word.entry.form for word
-                  in manager.filter_by_levenshtein(gismu, 1)]
+        levens = [word.entry.form for word in neighbors[gismu]]
         leven_dict[len(levens)].append((gismu, levens))
+    return leven_dict
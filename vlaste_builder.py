@@ -1,17 +1,44 @@
 # coding=utf-8
 
-import re
+import hashlib
 import json
+import os
+import re
+import sys
 from collections import namedtuple, OrderedDict
+from collections.abc import MutableSequence
 
 from exceptions import (DictionaryBuildError, WordBuildError,
                         MetadataError, WordComponentsError)
+from vlaste_index import OTMIndex
+
+# Bump when the OTM-json written here changes in a way the checker cares
+# about; sidecars written under another version are not trusted.
+OTM_SCHEMA_VERSION = 1
+
+
+def sidecar_filename(filename):
+    """``jbo-XXX_otm.check`` holds the hash of ``jbo-XXX_otm.json`` as it
+    was saved, so that the file can be loaded without being checked."""
+    return os.path.splitext(filename)[0] + '.check'
 
 
 class DictionaryBuilder:
     def __init__(self):
         self.words = []
 
+    @property
+    def words(self):
+        return self.__words
+
+    @words.setter
+    def words(self, words):
+        """A sequence without a ``version`` (eg. a plain list) is copied
+        into a WordList, so that any change to the words can be told."""
+        if not hasattr(words, 'version'):
+            words = WordList(words)
+        self.__words = words
+
     def append(self, word: str) -> None:
         if isinstance(word, WordBuilder):
             self.words.append(word)
@@ -34,25 +61,212 @@ class DictionaryBuilder:
         built_dict.update(self.metadata.as_dict())
         return built_dict
 
-    def save(self, filename):
-        predata = self.build()
-        otmized_json = json.dumps(predata, indent=2, ensure_ascii=False)
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(otmized_json)
+    def save(self, filename, index=True, payload=False):
+        """Write OTM-json with its sidecar and, unless ``index`` is False,
+        its ``OTMIndex``. With ``payload``, the written bytes are returned
+        too, eg. to be zipped without reading the file again."""
+        entries, spans, chunks = [], [], []
+        sha = hashlib.sha256()
+        offset = 0
+        with open(filename, 'wb') as f:
+            for word, text in self._iter_pieces():
+                data = text.encode('utf-8')
+                if word is not None:
+                    entries.append(word.entry)
+                    spans.append((offset, offset + len(data)))
+                if payload:
+                    chunks.append(data)
+                sha.update(data)
+                f.write(data)
+                offset += len(data)
             print("Written to {}.".format(filename))
+        with open(sidecar_filename(filename), 'w', encoding='utf-8') as f:
+            json.dump({"schema": OTM_SCHEMA_VERSION,
+                       "sha256": sha.hexdigest(),
+                       "size": offset}, f)
+        if index:
+            OTMIndex.write(filename, entries, spans, self.metadata.as_dict())
+        if payload:
+            return b''.join(chunks)
+
+    def _iter_pieces(self):
+        """Yield the OTM-json text piece by piece as ``(word, text)``,
+        ``word`` being None for the pieces between words. Joined, the text
+        is the same as ``json.dumps(self.build(), indent=2,
+        ensure_ascii=False)``, without building the whole tree first."""
+        yield None, '{\n  "words": '
+        separator = '[\n    '
+        for word in self.words:
+            yield None, separator
+            yield word, _indented_json(word.build(), 4)
+            separator = ',\n    '
+        yield None, '[]' if separator == '[\n    ' else '\n  ]'
+        for key, value in self.metadata.as_dict().items():
+            key = json.dumps(key, ensure_ascii=False)
+            yield None, ',\n  {}: {}'.format(key, _indented_json(value, 2))
+        yield None, '\n}'
 
     @classmethod
-    def load(cls, otmized_json, builder=None):
+    def load(cls, otmized_json, builder=None, interner=None):
+        """With ``interner``, words share their forms, titles and entries
+        with every other dictionary loaded through the same Interner."""
         if builder is None:
             builder = WordBuilder
         result = cls()
-        result.words.extend([builder.load(word)
-                             for word in otmized_json["words"]])
+        result.words = cls._load_words(otmized_json["words"], builder,
+                                       interner)
         result.__metadata = {key: otmized_json[key]
                              for key in otmized_json.keys()
                              if key != "words"}
         return result
 
+    @staticmethod
+    def _load_words(words, builder, interner=None):
+        return [builder.load(word, interner) for word in words]
+
+
+class LazyDictionaryBuilder(DictionaryBuilder):
+    """DictionaryBuilder whose words become WordBuilders only when accessed.
+    ``otmized_json["words"]`` may be any iterable of word dicts,
+    eg. ``OTMizedJsonDealer.iter_words()``."""
+    @staticmethod
+    def _load_words(words, builder, interner=None):
+        return LazyWords(words, builder, interner=interner)
+
+
+class MappedDictionaryBuilder(LazyDictionaryBuilder):
+    """LazyDictionaryBuilder reading each word straight out of an OTM-json
+    file, through the ``OTMIndex`` written next to it by ``save``."""
+    @classmethod
+    def open(cls, filename, builder=None, interner=None):
+        if builder is None:
+            builder = WordBuilder
+        index = OTMIndex(filename)
+        result = cls.load(dict(index.metadata(), words=()), builder)
+        result.words = LazyWords(range(len(index)), builder, index.word,
+                                 interner)
+        result.index = index
+        return result
+
+
+class LazyWords(MutableSequence):
+    """List of words keeping each word as its dict until it is accessed.
+    With ``fetch``, ``dicts`` holds what ``fetch`` turns into the dicts.
+    ``version`` goes up whenever the list is changed."""
+    def __init__(self, dicts, builder, fetch=None, interner=None):
+        self.__dicts = list(dicts)
+        self.__words = [None] * len(self.__dicts)
+        self.__builder = builder
+        self.__fetch = fetch
+        self.__interner = interner
+        self.version = 0
+
+    def __len__(self):
+        return len(self.__words)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        word = self.__words[i]
+        if word is None:
+            dic = self.__dicts[i]
+            if self.__fetch is not None:
+                dic = self.__fetch(dic)
+            word = self.__builder.load(dic, self.__interner)
+            self.__words[i] = word
+            self.__dicts[i] = None
+        return word
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __setitem__(self, i, word):
+        if isinstance(i, slice):
+            word = list(word)
+            self.__dicts[i] = [None] * len(word)
+        else:
+            self.__dicts[i] = None
+        self.__words[i] = word
+        self.version += 1
+
+    def __delitem__(self, i):
+        del self.__dicts[i]
+        del self.__words[i]
+        self.version += 1
+
+    def insert(self, i, word):
+        self.__dicts.insert(i, None)
+        self.__words.insert(i, word)
+        self.version += 1
+
+
+class WordList(list):
+    """List of words whose ``version`` goes up whenever it is changed,
+    so that indexes made from it can tell they are stale in O(1)."""
+    __slots__ = ("version",)
+
+    def __init__(self, words=()):
+        super().__init__(words)
+        self.version = 0
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+    def __setitem__(self, i, word):
+        super().__setitem__(i, word)
+        self.version += 1
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.version += 1
+
+    def __iadd__(self, words):
+        self.extend(words)
+        return self
+
+    def __imul__(self, n):
+        self.version += 1
+        return super().__imul__(n)
+
+    def append(self, word):
+        super().append(word)
+        self.version += 1
+
+    def extend(self, words):
+        super().extend(words)
+        self.version += 1
+
+    def insert(self, i, word):
+        super().insert(i, word)
+        self.version += 1
+
+    def pop(self, i=-1):
+        self.version += 1
+        return super().pop(i)
+
+    def remove(self, word):
+        super().remove(word)
+        self.version += 1
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.version += 1
+
+    def reverse(self):
+        super().reverse()
+        self.version += 1
+
+
+def _indented_json(obj, indent):
+    """``json.dumps(obj, indent=2)`` as it appears nested ``indent`` deep."""
+    return (json.dumps(obj, indent=2, ensure_ascii=False)
+            .replace('\n', '\n' + ' ' * indent))
+
 
 class Metadata:
     def __init__(self, zpdic=True):
@@ -84,6 +298,9 @@ class Metadata:
 
 class WordBuilder:
     """Class building a Word object."""
+    __slots__ = ("entry", "translations", "contents",
+                 "relations", "variations", "tags")
+
     def __init__(self):
         self.translations = WordComponents(Translation)
         self.contents = WordComponents(Content)
@@ -139,17 +356,26 @@ class WordBuilder:
         ])
 
     @classmethod
-    def load(cls, dic):
+    def load(cls, dic, interner=None):
+        if interner is None:
+            interner = _NO_INTERNING
+        string, content = interner.string, interner.content
         result = cls()
-        result.entry = Entry(dic["entry"]["id"], dic["entry"]["form"])
-        result.translations.extend([Translation(**trsl)
+        result.entry = interner.entry(dic["entry"]["id"],
+                                      dic["entry"]["form"])
+        result.translations.extend([Translation(string(trsl["title"]),
+                                                trsl["forms"])
                                     for trsl in dic["translations"]])
-        result.tags = dic["tags"]
-        result.contents.extend([Content(**cnt) for cnt in dic["contents"]])
-        result.variations.extend([Variation(**var)
+        result.tags = [string(tag) for tag in dic["tags"]]
+        result.contents.extend([content(cnt["title"], cnt["text"])
+                                for cnt in dic["contents"]])
+        result.variations.extend([Variation(string(var["title"]),
+                                            string(var["form"]))
                                   for var in dic["variations"]])
-        result.relations.extend([Relation(relation["title"],
-                                          Entry(**relation["entry"]))
+        result.relations.extend([Relation(string(relation["title"]),
+                                          interner.entry(
+                                              relation["entry"]["id"],
+                                              relation["entry"]["form"]))
                                  for relation in dic["relations"]])
         return result
 
@@ -158,6 +384,8 @@ class WordBuilder:
 
 
 class JbovlasteWordBuilder(WordBuilder):
+    __slots__ = ()
+
     def delete_dollar(self):
         """definition の $x_n$ を x_n に変える。"""
         sentence = self.translations[0].forms[0]
@@ -165,14 +393,14 @@ class JbovlasteWordBuilder(WordBuilder):
         return self
 
     def glosswords(self):
-        if 'glossword' not in self.contents.keys():
+        if not self.contents.has('glossword'):
             return []
         glosses_text = self.contents.find('glossword')[1].text
         glosses = glosses_text.split("\n")
         return [gloss.strip("- ") for gloss in glosses]
 
     def add_glossword(self, glossword):
-        if 'glossword' in self.contents.keys():
+        if self.contents.has('glossword'):
             glosses_text = self.contents.find('glossword')[1].text
             glosses_text = '\n' + '- ' + glossword
             self.contents.renew('glossword', glosses_text)
@@ -180,7 +408,7 @@ class JbovlasteWordBuilder(WordBuilder):
             self.contents.append(Content('glossword', '- ' + glossword))
 
     def keywords(self):
-        if 'keyword' not in self.contents.keys():
+        if not self.contents.has('keyword'):
             return []
         glosses_text = self.contents.find('keyword')[1].text
         glosses = glosses_text.split("\n")
@@ -188,13 +416,48 @@ class JbovlasteWordBuilder(WordBuilder):
                 for i, gloss in enumerate(glosses, 1)}
 
 
+_NOTES_KEYWORDS = ("大意", "読み方", "語呂合わせ", "関連語")
+# 「・大意:」などの直前で notes を区切る。
+_NOTES_SECTION = re.compile("|".join(r'・\s*(?={}\s*[:：])'.format(keyword)
+                                     for keyword in _NOTES_KEYWORDS))
+_NOTES_LABELS = {keyword: re.compile(r'{}\s*[:：]\s*'.format(keyword))
+                 for keyword in _NOTES_KEYWORDS}
+_EXAMPLE = re.compile(r'(「[^／]+／[^／]+」)')
+_CONTENTS_ORDER = ("notes", "読み方", "glossword", "keyword", "用例",
+                   "語呂合わせ", "関連語", "rafsi", "username")
+
+
+def _split_notes(text):
+    """notesをkeywordsごとに分け、それぞれの項目の辞書を返す。"""
+    dic = {"notes": ""}
+    for phrase in _NOTES_SECTION.split(text):
+        for keyword in _NOTES_KEYWORDS:
+            if keyword in phrase:
+                dic[keyword] = _NOTES_LABELS[keyword].sub("", phrase).rstrip()
+                break
+        else:
+            dic["notes"] += phrase.rstrip()
+    return dic
+
+
+def _extract_examples(text):
+    """text から「…／…」を抜き出し、残りの text と用例のリストを返す。"""
+    pieces = _EXAMPLE.split(text)
+    return "".join(pieces[::2]), pieces[1::2]
+
+
+def _is_blank(text):
+    return not text or text.isspace()
+
+
 class WordBuilderForJapanese(JbovlasteWordBuilder):
     """Notes内のごたごたを上手く切り分け別に登録するメソッドを独自にもつ。
     Basically, all you need is call for ``whole_execute`` method! :)"""
+    __slots__ = ()
 
     def add_split_notes_to_content(self):
         """split_notesが返した辞書をもとに word に content を追加する。"""
-        if "notes" in self.contents.keys():
+        if self.contents.has("notes"):
             new_components = self.split_notes()
             # keywords = ["大意", "読み方", "語呂合わせ", "関連語"]
             for keyword, text in new_components.items():
@@ -206,43 +469,26 @@ class WordBuilderForJapanese(JbovlasteWordBuilder):
 
     def split_notes(self):
         """notesをkeywordsごとに分け、それぞれの項目の辞書を返す。"""
-        keywords = ["大意", "読み方", "語呂合わせ", "関連語"]
-        regex_template = r'・\s*(?={}\s*[:：])'
-        regex = r'{}|{}|{}|{}'.format(*(regex_template.format(keyword)
-                                        for keyword in keywords))
-        regex_template2 = r'{}\s*[:：]\s*'
-        if "notes" not in self.contents.keys():
+        if not self.contents.has("notes"):
             return {}
-        dic = {}
-        dic["notes"] = ""
-        for phrase in re.split(regex, self.contents.find("notes")[1].text):
-            for keyword in keywords:
-                if keyword in phrase:
-                    s = re.sub(regex_template2.format(keyword), "", phrase)
-                    s = re.sub(r'\s*$', "", s)
-                    dic[keyword] = s
-                    break
-            else:
-                dic["notes"] += re.sub(r'\s*$', "", phrase)
-        return dic
+        return _split_notes(self.contents.find("notes")[1].text)
 
     def example_extract(self):
         """Extract '「…／…」' expressions from notes,
         adding them to contents as '用例' component"""
-        regex = r'「[^／]+／[^／]+」'
-        if "notes" in self.contents.keys():
-            notes_text = self.contents.find("notes")[1].text
-            examples = re.findall(regex, notes_text)
+        if self.contents.has("notes"):
+            notes_text, examples = _extract_examples(
+                self.contents.find("notes")[1].text)
             if examples:
-                self.contents.renew("notes", re.sub(regex, "", notes_text))
+                self.contents.renew("notes", notes_text)
                 self.add(Content("用例", "\n".join(examples)))
         return self
 
     def integrate_gloss(self):
         """Integrate '大意' component with 'glossword' component."""
-        if "大意" in self.contents.keys():
+        if self.contents.has("大意"):
             pre_gloss = self.contents.find("大意")[1].text
-            if "glossword" in self.contents.keys():
+            if self.contents.has("glossword"):
                 glosses = self.contents.find("glossword")[1].text
                 if pre_gloss not in self.glosswords():
                     self.add_glossword(pre_gloss)
@@ -253,23 +499,61 @@ class WordBuilderForJapanese(JbovlasteWordBuilder):
 
     def sort_contents(self):
         # 大意 は gloss に統合している。
-        sorting = ["notes", "読み方", "glossword", "keyword", "用例",
-                   "語呂合わせ", "関連語", "rafsi", "username"]
-        self.contents.sort_bytitle(sorting)
+        self.contents.sort_bytitle(_CONTENTS_ORDER)
         return self
 
     def delete_emptynotes(self):
         """Delete a notes component with no text."""
         cs = self.contents
-        if ("notes" in cs.keys() and
-                re.search(r'^\s*$', cs.find("notes")[1].text)):
+        if cs.has("notes") and _is_blank(cs.find("notes")[1].text):
             del self.contents[self.contents.find("notes")[0]]
         return self
 
     def whole_execute(self):
-        """All is done well."""
-        self.add_split_notes_to_content().example_extract()
-        self.integrate_gloss().sort_contents().delete_emptynotes()
+        """All is done well.
+        Same as calling ``add_split_notes_to_content``, ``example_extract``,
+        ``integrate_gloss``, ``sort_contents`` and ``delete_emptynotes``
+        in turn, but reads notes once and renews contents once."""
+        contents = list(self.contents)
+        titles = [content.title for content in contents]
+        if "notes" in titles:
+            at = titles.index("notes")
+            sections = _split_notes(contents[at].text)
+            notes_text, examples = _extract_examples(sections.pop("notes"))
+            contents[at] = Content("notes", notes_text)
+            contents.extend(Content(keyword, text)
+                            for keyword, text in sections.items())
+            if examples:
+                contents.append(Content("用例", "\n".join(examples)))
+            titles = [content.title for content in contents]
+
+        if "大意" in titles:
+            at = titles.index("大意")
+            pre_gloss = contents[at].text
+            if "glossword" in titles:
+                gloss_at = titles.index("glossword")
+                glosses = contents[gloss_at].text.split("\n")
+                if pre_gloss not in [gloss.strip("- ") for gloss in glosses]:
+                    # add_glossword と同じく、既存の glossword を置き換える。
+                    contents[gloss_at] = Content("glossword",
+                                                 "\n- " + pre_gloss)
+            else:
+                contents.append(Content("glossword", pre_gloss))
+            del contents[at]
+            titles = [content.title for content in contents]
+
+        firsts = {}
+        for i, title in enumerate(titles):
+            firsts.setdefault(title, i)
+        front = [firsts[title] for title in _CONTENTS_ORDER
+                 if title in firsts]
+        moved = set(front)
+        contents = ([contents[i] for i in front] +
+                    [content for i, content in enumerate(contents)
+                     if i not in moved])
+        if "notes" in firsts and _is_blank(contents[0].text):
+            del contents[0]
+        self.contents[:] = contents
         return self
 
 Entry = namedtuple("Entry", "id form")
@@ -278,9 +562,64 @@ Content = namedtuple("Content", "title text")
 Variation = namedtuple("Variation", "title form")
 
 
+class Interner:
+    """Keeps one object for each form, title and entry, so that words and
+    dictionaries made through the same Interner share them, and comparing
+    them mostly ends at an identity check.
+    Texts of contents titled one of ``shared_contents`` are shared too;
+    other texts (notes, definitions...) are seldom equal and kept as is."""
+    __slots__ = ("shared_contents", "__entries")
+
+    def __init__(self, shared_contents=("username", "rafsi")):
+        self.shared_contents = frozenset(shared_contents)
+        self.__entries = {}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def string(string):
+        return sys.intern(string)
+
+    def entry(self, id_, form):
+        entry = Entry(id_, form)
+        shared = self.__entries.get(entry)
+        if shared is None:
+            shared = self.__entries[entry] = Entry(id_, sys.intern(form))
+        return shared
+
+    def content(self, title, text):
+        title = sys.intern(title)
+        if title in self.shared_contents:
+            text = sys.intern(text)
+        return Content(title, text)
+
+
+class _NoInterning:
+    """Interner keeping everything as is."""
+    __slots__ = ()
+
+    @staticmethod
+    def string(string):
+        return string
+
+    @staticmethod
+    def entry(id_, form):
+        return Entry(id_, form)
+
+    @staticmethod
+    def content(title, text):
+        return Content(title, text)
+
+
+_NO_INTERNING = _NoInterning()
+
+
 class Relation:
     """mostly same with namedtuple,
     except that ``_asdict`` method works well for Entry object."""
+    __slots__ = ("_title", "_entry")
+
     def __init__(self, title, entry):
         self._title = title
         self._entry = entry
@@ -299,27 +638,98 @@ class Relation:
 
 
 class WordComponents(list):
+    """List of components of one type.
+    It keeps the position of the first component of each title, so that
+    ``has`` and ``find`` neither scan nor allocate. The map is made on the
+    first lookup, kept up to date by ``append``, ``extend`` and renewing
+    with the same title, and remade after any other change."""
+    __slots__ = ("__type", "__index")
+
     def __init__(self, component_type):
         self.__type = component_type
+        self.__index = None
+
+    def __reduce__(self):
+        return self.__class__, (self.__type,), None, iter(self)
+
+    def __lookup(self):
+        if self.__index is None:
+            index = {}
+            for i, component in enumerate(self):
+                index.setdefault(component.title, i)
+            self.__index = index
+        return self.__index
 
     def append(self, component):
         if not isinstance(component, self.__type):
             raise WordComponentsError("component must be {}."
                                       .format(self.__type))
         else:
+            if self.__index is not None:
+                self.__index.setdefault(component.title, len(self))
             super().append(component)
 
+    def extend(self, components):
+        start = len(self)
+        super().extend(components)
+        if self.__index is not None:
+            for i in range(start, len(self)):
+                self.__index.setdefault(self[i].title, i)
+
+    def __setitem__(self, i, value):
+        if self.__index is not None and (isinstance(i, slice) or
+                                         self[i].title != value.title):
+            self.__index = None
+        super().__setitem__(i, value)
+
+    def __delitem__(self, i):
+        self.__index = None
+        super().__delitem__(i)
+
+    def __iadd__(self, components):
+        self.extend(components)
+        return self
+
+    def __imul__(self, n):
+        self.__index = None
+        return super().__imul__(n)
+
+    def insert(self, i, component):
+        self.__index = None
+        super().insert(i, component)
+
+    def pop(self, i=-1):
+        self.__index = None
+        return super().pop(i)
+
+    def remove(self, component):
+        self.__index = None
+        super().remove(component)
+
+    def clear(self):
+        self.__index = None
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self.__index = None
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self.__index = None
+        super().reverse()
+
     def keys(self):
         return [component.title for component in self]
 
+    def has(self, title):
+        """Whether a component has ``title``, without making ``keys``."""
+        return title in self.__lookup()
+
     def find(self, title):
-        generator = ((i, component) for i, component in enumerate(self)
-                     if component.title == title)
-        try:
-            result = next(generator)
-        except StopIteration:
+        i = self.__lookup().get(title)
+        if i is None:
             raise WordComponentsError("No component has the 'title'.")
-        return result
+        return i, self[i]
 
     def renew(self, title, new_value):
         self[self.find(title)[0]] = self.__type(title, new_value)
@@ -327,12 +737,16 @@ class WordComponents(list):
     def sort_bytitle(self, titles):
         """titlesの順に並べる。インプレースであることに注意。
         titlesに記載のないtitleをもつ要素はその順番を保持したまま後方に寄る。"""
-        titles.reverse()
+        index = self.__lookup()
+        firsts = []
         for title in titles:
-            if title in self.keys():
-                i, component = self.find(title)
-                del self[i]
-                self[0:0] = [component]
+            i = index.get(title)
+            if i is not None and i not in firsts:
+                firsts.append(i)
+        moved = set(firsts)
+        self[:] = ([self[i] for i in firsts] +
+                   [component for i, component in enumerate(self)
+                    if i not in moved])
 
     def build(self):
         return [component._asdict() for component in self]
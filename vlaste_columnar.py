@@ -0,0 +1,300 @@
+# coding=utf-8
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from vlaste_builder import (Entry, Translation, Content, Variation, Relation)
+from exceptions import WordComponentsError
+
+
+class StringTable:
+    """Strings stored once and referred to by number.
+    Share one table between dictionaries to store their common forms,
+    titles and tags only once."""
+    __slots__ = ("strings", "__numbers")
+
+    def __init__(self):
+        self.strings = []
+        self.__numbers = {}
+
+    def number(self, string):
+        n = self.__numbers.get(string)
+        if n is None:
+            n = self.__numbers[string] = len(self.strings)
+            self.strings.append(string)
+        return n
+
+    def __getitem__(self, n):
+        return self.strings[n]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class _TextColumn:
+    """Texts as one utf-8 blob and the offsets of each of them."""
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.offsets = array('Q', [0])
+
+    def append(self, text):
+        self.blob += text.encode('utf-8')
+        self.offsets.append(len(self.blob))
+
+    def __getitem__(self, k):
+        return self.blob[self.offsets[k]:self.offsets[k + 1]].decode('utf-8')
+
+
+class ColumnarDictionary:
+    """Read-only dictionary held column by column instead of word by word.
+
+    Entry ids are a typed array, forms, titles, tags and short forms are
+    numbers into a ``StringTable``, and texts live in utf-8 blobs. Each
+    component kind has an offset column telling where the components of
+    word i start and end. ``words`` gives views presenting the read API
+    of ``WordBuilder`` without copying the word out of the columns."""
+
+    def __init__(self, strings=None):
+        self.strings = StringTable() if strings is None else strings
+        self.ids = array('q')
+        self.forms = array('I')
+        self.tag_offsets = array('I', [0])
+        self.tags = array('I')
+        self.translation_offsets = array('I', [0])
+        self.translation_titles = array('I')
+        self.translation_form_offsets = array('I', [0])
+        self.translation_forms = _TextColumn()
+        self.content_offsets = array('I', [0])
+        self.content_titles = array('I')
+        self.content_texts = _TextColumn()
+        self.variation_offsets = array('I', [0])
+        self.variation_titles = array('I')
+        self.variation_forms = array('I')
+        self.relation_offsets = array('I', [0])
+        self.relation_titles = array('I')
+        self.relation_ids = array('q')
+        self.relation_forms = array('I')
+        self.metadata = {}
+        self.words = _WordViews(self)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_builder(cls, builder, strings=None):
+        result = cls(strings)
+        for word in builder.words:
+            result.append(word)
+        result.metadata = builder.metadata
+        return result
+
+    @classmethod
+    def load(cls, otmized_json, strings=None):
+        result = cls(strings)
+        for word in otmized_json["words"]:
+            result.append(word)
+        result.metadata = {key: otmized_json[key]
+                           for key in otmized_json.keys() if key != "words"}
+        return result
+
+    def append(self, word):
+        """Add a word, given as a WordBuilder (or view) or as its dict."""
+        if not isinstance(word, dict):
+            word = word.build()
+        number = self.strings.number
+        self.ids.append(word["entry"]["id"])
+        self.forms.append(number(word["entry"]["form"]))
+        self.tags.extend(number(tag) for tag in word["tags"])
+        self.tag_offsets.append(len(self.tags))
+        for translation in word["translations"]:
+            self.translation_titles.append(number(translation["title"]))
+            for form in translation["forms"]:
+                self.translation_forms.append(form)
+            self.translation_form_offsets.append(
+                len(self.translation_forms.offsets) - 1)
+        self.translation_offsets.append(len(self.translation_titles))
+        for content in word["contents"]:
+            self.content_titles.append(number(content["title"]))
+            self.content_texts.append(content["text"])
+        self.content_offsets.append(len(self.content_titles))
+        for variation in word["variations"]:
+            self.variation_titles.append(number(variation["title"]))
+            self.variation_forms.append(number(variation["form"]))
+        self.variation_offsets.append(len(self.variation_titles))
+        for relation in word["relations"]:
+            self.relation_titles.append(number(relation["title"]))
+            self.relation_ids.append(relation["entry"]["id"])
+            self.relation_forms.append(number(relation["entry"]["form"]))
+        self.relation_offsets.append(len(self.relation_titles))
+
+    def form(self, i):
+        return self.strings[self.forms[i]]
+
+    def iter_forms(self):
+        """Entry forms in order, without making any view."""
+        strings = self.strings.strings
+        return (strings[n] for n in self.forms)
+
+    def _translation(self, k):
+        forms = self.translation_forms
+        start = self.translation_form_offsets[k]
+        end = self.translation_form_offsets[k + 1]
+        return Translation(self.strings[self.translation_titles[k]],
+                           [forms[f] for f in range(start, end)])
+
+    def _content(self, k):
+        return Content(self.strings[self.content_titles[k]],
+                       self.content_texts[k])
+
+    def _variation(self, k):
+        return Variation(self.strings[self.variation_titles[k]],
+                         self.strings[self.variation_forms[k]])
+
+    def _relation(self, k):
+        return Relation(self.strings[self.relation_titles[k]],
+                        Entry(self.relation_ids[k],
+                              self.strings[self.relation_forms[k]]))
+
+
+class _WordViews(Sequence):
+    __slots__ = ("_store",)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    @property
+    def version(self):
+        """Words are only ever appended, so their number tells
+        whether they have changed."""
+        return len(self._store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [WordView(self._store, j)
+                    for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("word index out of range")
+        return WordView(self._store, i)
+
+    def __iter__(self):
+        store = self._store
+        for i in range(len(store)):
+            yield WordView(store, i)
+
+
+class WordView:
+    """Word i of a ColumnarDictionary, read like a WordBuilder."""
+    __slots__ = ("_store", "_i")
+
+    def __init__(self, store, i):
+        self._store = store
+        self._i = i
+
+    @property
+    def entry(self):
+        return Entry(self._store.ids[self._i], self._store.form(self._i))
+
+    @property
+    def tags(self):
+        store = self._store
+        start, end = store.tag_offsets[self._i], store.tag_offsets[self._i + 1]
+        return [store.strings[store.tags[k]] for k in range(start, end)]
+
+    @property
+    def translations(self):
+        return _ComponentsView(self._store, self._store.translation_offsets,
+                               self._store.translation_titles,
+                               self._store._translation, self._i)
+
+    @property
+    def contents(self):
+        return _ComponentsView(self._store, self._store.content_offsets,
+                               self._store.content_titles,
+                               self._store._content, self._i)
+
+    @property
+    def variations(self):
+        return _ComponentsView(self._store, self._store.variation_offsets,
+                               self._store.variation_titles,
+                               self._store._variation, self._i)
+
+    @property
+    def relations(self):
+        return _ComponentsView(self._store, self._store.relation_offsets,
+                               self._store.relation_titles,
+                               self._store._relation, self._i)
+
+    def build(self):
+        return OrderedDict([
+            ("entry", self.entry._asdict()),
+            ("translations", self.translations.build()),
+            ("tags", self.tags),
+            ("contents", self.contents.build()),
+            ("variations", self.variations.build()),
+            ("relations", self.relations.build())
+        ])
+
+    def __eq__(self, other):
+        return (isinstance(other, WordView) and
+                other._store is self._store and other._i == self._i)
+
+    def __hash__(self):
+        return hash((id(self._store), self._i))
+
+    def __repr__(self):
+        return "<WordView: {}>".format(self.entry)
+
+
+class _ComponentsView(Sequence):
+    """Components of one kind of a WordView, read like WordComponents."""
+    __slots__ = ("_store", "_titles", "_make", "_start", "_end")
+
+    def __init__(self, store, offsets, titles, make, i):
+        self._store = store
+        self._titles = titles
+        self._make = make
+        self._start = offsets[i]
+        self._end = offsets[i + 1]
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("component index out of range")
+        return self._make(self._start + k)
+
+    def __iter__(self):
+        for k in range(self._start, self._end):
+            yield self._make(k)
+
+    def keys(self):
+        strings = self._store.strings
+        return [strings[self._titles[k]]
+                for k in range(self._start, self._end)]
+
+    def has(self, title):
+        strings = self._store.strings
+        return any(strings[self._titles[k]] == title
+                   for k in range(self._start, self._end))
+
+    def find(self, title):
+        strings = self._store.strings
+        for k in range(self._start, self._end):
+            if strings[self._titles[k]] == title:
+                return k - self._start, self._make(k)
+        raise WordComponentsError("No component has the 'title'.")
+
+    def build(self):
+        return [component._asdict() for component in self]
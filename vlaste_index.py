@@ -0,0 +1,511 @@
+# coding=utf-8
+import json
+import mmap
+import os
+import re
+import struct
+from multiprocessing import shared_memory
+try:
+    from re import _parser as _regex_parser
+except ImportError:  # Python < 3.11
+    import sre_parse as _regex_parser
+
+from exceptions import StaleIndex
+
+
+class OTMIndex:
+    """Read-only index of an OTM-json file, opened with mmap.
+
+    ``jbo-XXX_otm.idx`` next to ``jbo-XXX_otm.json`` holds the byte span of
+    every word in file order, the words sorted by entry id and by entry
+    form, and the metadata. A word is parsed only when it is asked for,
+    and every process opening the same files shares the OS page cache."""
+    MAGIC = b'JBVLIDX\x00'
+    VERSION = 1
+    # magic, version, word count, json size, json mtime_ns, metadata size
+    HEADER = struct.Struct('<8sIIQqQ')
+    SPAN = struct.Struct('<QQ')
+    BY_ID = struct.Struct('<qI')
+    BY_FORM = struct.Struct('<QII')
+
+    def __init__(self, json_filename):
+        self.json_filename = json_filename
+        self.filename = self.filename_for(json_filename)
+        self.__json = None
+        with open(self.filename, 'rb') as f:
+            self.__index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, count, size, mtime_ns,
+         meta_size) = self.HEADER.unpack_from(self.__index)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise StaleIndex("{} is not a version {} index."
+                             .format(self.filename, self.VERSION))
+        stat = os.stat(json_filename)
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            self.close()
+            raise StaleIndex("{} has changed since {} was written."
+                             .format(json_filename, self.filename))
+        with open(json_filename, 'rb') as f:
+            self.__json = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__count = count
+        self.__spans_at = self.HEADER.size
+        self.__ids_at = self.__spans_at + count * self.SPAN.size
+        self.__forms_at = self.__ids_at + count * self.BY_ID.size
+        self.__keys_at = self.__forms_at + count * self.BY_FORM.size
+        self.__meta_at = len(self.__index) - meta_size
+
+    @staticmethod
+    def filename_for(json_filename):
+        return os.path.splitext(json_filename)[0] + '.idx'
+
+    @classmethod
+    def write(cls, json_filename, entries, spans, metadata):
+        """Write the index of ``json_filename``, where word ``i`` has
+        ``entries[i]`` and lies on bytes ``spans[i]`` of the file."""
+        keys = [entry.form.encode('utf-8') for entry in entries]
+        key_offsets = []
+        offset = 0
+        for key in keys:
+            key_offsets.append(offset)
+            offset += len(key)
+        by_id = sorted(range(len(entries)), key=lambda i: entries[i].id)
+        by_form = sorted(range(len(entries)), key=keys.__getitem__)
+        meta = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+        stat = os.stat(json_filename)
+
+        filename = cls.filename_for(json_filename)
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(entries),
+                                    stat.st_size, stat.st_mtime_ns,
+                                    len(meta)))
+            for span in spans:
+                f.write(cls.SPAN.pack(*span))
+            for i in by_id:
+                f.write(cls.BY_ID.pack(entries[i].id, i))
+            for i in by_form:
+                f.write(cls.BY_FORM.pack(key_offsets[i], len(keys[i]), i))
+            for key in keys:
+                f.write(key)
+            f.write(meta)
+        os.replace(tmpname, filename)
+
+    def __len__(self):
+        return self.__count
+
+    def word(self, i):
+        """The i-th word of the file as a dict."""
+        if not 0 <= i < self.__count:
+            raise IndexError("word index out of range")
+        start, end = self.SPAN.unpack_from(self.__index,
+                                           self.__spans_at +
+                                           i * self.SPAN.size)
+        return json.loads(self.__json[start:end])
+
+    def metadata(self):
+        return json.loads(self.__index[self.__meta_at:])
+
+    def ordinal_by_id(self, id_):
+        """Position of the word whose entry id is ``id_``, or None."""
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            found, i = self.BY_ID.unpack_from(self.__index,
+                                              self.__ids_at +
+                                              middle * self.BY_ID.size)
+            if found < id_:
+                low = middle + 1
+            elif found > id_:
+                high = middle
+            else:
+                return i
+        return None
+
+    def ordinals_by_form(self, form):
+        """Positions of the words whose entry form is ``form``."""
+        key = form.encode('utf-8')
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__form_key(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        result = []
+        while low < self.__count:
+            found, i = self.__form_key(low)
+            if found != key:
+                break
+            result.append(i)
+            low += 1
+        return result
+
+    def __form_key(self, n):
+        offset, length, i = self.BY_FORM.unpack_from(self.__index,
+                                                     self.__forms_at +
+                                                     n * self.BY_FORM.size)
+        start = self.__keys_at + offset
+        return self.__index[start:start + length], i
+
+    def close(self):
+        self.__index.close()
+        if self.__json is not None:
+            self.__json.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_APOSTROPHES = str.maketrans("’‘`´ʼ", "'''''")
+
+
+def normalize_form(form):
+    """Form as looked up when nothing has it exactly:
+    lower case, any apostrophe as "'", and no dots around it."""
+    return form.translate(_APOSTROPHES).strip('.').lower()
+
+
+class EntryIndex:
+    """form → entries of the words of a dictionary, built in one pass.
+
+    ``get`` finds a form exactly first, then by ``normalize_form``; when
+    several words share a form, the first one in word order wins."""
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.__exact = {}
+        self.__normalized = {}
+        for i, entry in enumerate(self.entries):
+            self.__exact.setdefault(entry.form, []).append(i)
+            self.__normalized.setdefault(normalize_form(entry.form),
+                                         []).append(i)
+
+    @classmethod
+    def from_dictionary(cls, dictionary):
+        return cls(word.entry for word in dictionary.words)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, form):
+        return form in self.__exact
+
+    def exact(self, form):
+        """The entry whose form is ``form``, or None."""
+        ordinals = self.__exact.get(form)
+        return None if ordinals is None else self.entries[ordinals[0]]
+
+    def id_of(self, form):
+        """Entry id of ``exact(form)``, or None."""
+        ordinals = self.__exact.get(form)
+        return None if ordinals is None else self.entries[ordinals[0]].id
+
+    def get(self, form, default=None):
+        ordinals = self.ordinals(form, normalized=True)
+        return self.entries[ordinals[0]] if ordinals else default
+
+    def ordinals(self, form, normalized=False):
+        """Positions of the words having ``form``; with ``normalized``,
+        of those having it after normalization if none has it exactly."""
+        ordinals = self.__exact.get(form)
+        if ordinals is None and normalized:
+            ordinals = self.__normalized.get(normalize_form(form))
+        return list(ordinals or ())
+
+
+def ids_by_form(entry_lists):
+    """form → tuple of the entry id of the form in each list of entries
+    (None where it has none), for every form of any of them. As in
+    EntryIndex, the first entry of a form in a list wins."""
+    entry_lists = list(entry_lists)
+    table = {}
+    for column, entries in enumerate(entry_lists):
+        for entry in entries:
+            ids = table.get(entry.form)
+            if ids is None:
+                ids = table[entry.form] = [None] * len(entry_lists)
+            if ids[column] is None:
+                ids[column] = entry.id
+    return {form: tuple(ids) for form, ids in table.items()}
+
+
+class SharedEntryIndex:
+    """Read-only copy of an ``ids_by_form`` table (eg. with a column of
+    ids per language) in shared memory.
+
+    ``create`` writes it, and each worker process ``attach``es to it by
+    name instead of receiving a copy. Forms are sorted as utf-8 bytes and
+    found by binary search; the block is freed by ``unlink``."""
+    # number of forms, number of id columns
+    HEADER = struct.Struct('<II')
+    # form offset, form length, then an entry id per column
+    ROW = '<QI{}q'
+    # an entry id column with no entry of the form
+    NO_ID = -2 ** 63
+
+    def __init__(self, memory, owner=False):
+        self.__memory = memory
+        self.__owner = owner
+        self.__buf = memory.buf
+        self.__count, columns = self.HEADER.unpack_from(self.__buf)
+        self.__row = struct.Struct(self.ROW.format(columns))
+        self.__keys_at = self.HEADER.size + self.__count * self.__row.size
+
+    @property
+    def name(self):
+        return self.__memory.name
+
+    @classmethod
+    def create(cls, table, columns):
+        """``table`` as given by ``ids_by_form``, with ``columns``
+        ids for each form."""
+        rows = {form.encode('utf-8'): ids for form, ids in table.items()}
+        row = struct.Struct(cls.ROW.format(columns))
+        keys = sorted(rows)
+        table = bytearray()
+        offset = 0
+        for key in keys:
+            ids = (cls.NO_ID if id_ is None else id_ for id_ in rows[key])
+            table += row.pack(offset, len(key), *ids)
+            offset += len(key)
+        blob = b''.join(keys)
+        size = cls.HEADER.size + len(table) + len(blob)
+        memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        cls.HEADER.pack_into(memory.buf, 0, len(keys), columns)
+        at = cls.HEADER.size
+        memory.buf[at:at + len(table)] = table
+        at += len(table)
+        memory.buf[at:at + len(blob)] = blob
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name))
+
+    def __len__(self):
+        return self.__count
+
+    def ids_of(self, form):
+        """Entry id of ``form`` in each column (None where it has none),
+        or None if no column has it."""
+        key = form.encode('utf-8')
+        lo, hi = 0, self.__count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, length, *ids = self.__row.unpack_from(
+                self.__buf, self.HEADER.size + mid * self.__row.size)
+            at = self.__keys_at + offset
+            found = bytes(self.__buf[at:at + length])
+            if found == key:
+                return tuple(None if id_ == self.NO_ID else id_
+                             for id_ in ids)
+            if found < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def id_of(self, form):
+        """Entry id of ``form`` in the first column, or None."""
+        ids = self.ids_of(form)
+        return None if ids is None else ids[0]
+
+    def close(self):
+        self.__buf = None
+        self.__memory.close()
+
+    def unlink(self):
+        """Free the shared memory; only the creator may do this."""
+        self.close()
+        if self.__owner:
+            self.__memory.unlink()
+
+
+class BacklinkIndex:
+    """entry id → entries of the words referring to it.
+
+    relationize fills it while adding relations; ``from_dictionary``
+    makes it from the relations already in a dictionary. Each referring
+    word is listed once, in the order of the words it was made from."""
+    def __init__(self):
+        self.__sources = {}
+
+    def add(self, target_id, position, source):
+        """Word ``position``, whose entry is ``source``, refers to
+        ``target_id``."""
+        self.__sources.setdefault(target_id, {})[position] = source
+
+    @classmethod
+    def from_dictionary(cls, dictionary, title=""):
+        """Backlinks of the relations titled ``title`` (the ones
+        relationize adds)."""
+        result = cls()
+        for position, word in enumerate(dictionary.words):
+            for relation in word.relations:
+                if relation.title == title:
+                    result.add(relation.entry.id, position, word.entry)
+        return result
+
+    def __len__(self):
+        return len(self.__sources)
+
+    def __contains__(self, target_id):
+        return target_id in self.__sources
+
+    def sources(self, target_id):
+        """Entries of the words referring to ``target_id``."""
+        sources = self.__sources.get(target_id, {})
+        return [sources[position] for position in sorted(sources)]
+
+
+class BKTree:
+    """Forms kept in a Burkhard-Keller tree for a metric ``distance``
+    (eg. ``leven.levenshtein``), to find the forms near a form without
+    measuring the distance to every one of them.
+
+    Each node's children are keyed by their distance to it; by the
+    triangle inequality, only the children at ``d - k`` to ``d + k`` of
+    a node at ``d`` from the query can hold forms within ``k``. Words
+    sharing a form share a node."""
+    def __init__(self, forms, distance):
+        self.distance = distance
+        self.__root = None
+        self.__count = 0
+        for i, form in enumerate(forms):
+            self.add(form, i)
+
+    @classmethod
+    def from_dictionary(cls, dictionary, distance):
+        return cls((word.entry.form for word in dictionary.words), distance)
+
+    def __len__(self):
+        return self.__count
+
+    def add(self, form, ordinal):
+        """Add ``form`` as the form of word ``ordinal``."""
+        self.__count += 1
+        # node: [form, ordinals, {distance: child}]
+        if self.__root is None:
+            self.__root = [form, [ordinal], {}]
+            return
+        node = self.__root
+        while True:
+            d = self.distance(form, node[0])
+            if d == 0:
+                node[1].append(ordinal)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [form, [ordinal], {}]
+                return
+            node = child
+
+    def ordinals(self, form, k):
+        """Positions, in word order, of the words whose form is within
+        ``k`` of ``form``."""
+        found = []
+        stack = [] if self.__root is None else [self.__root]
+        while stack:
+            node = stack.pop()
+            d = self.distance(form, node[0])
+            if d <= k:
+                found.extend(node[1])
+            for child_d, child in node[2].items():
+                if d - k <= child_d <= d + k:
+                    stack.append(child)
+        found.sort()
+        return found
+
+    def neighbors(self, forms, k):
+        """form → ``ordinals(form, k)`` for each of ``forms``."""
+        return {form: self.ordinals(form, k) for form in set(forms)}
+
+
+class TrigramIndex:
+    """Forms by the trigrams (three-character substrings) they contain,
+    to find the forms containing a string or matching a regex without
+    looking at every form.
+
+    A string of three or more characters can only be in the forms having
+    all its trigrams, so only those are checked. Shorter strings, and
+    regexes with no such literal (or ignoring case), check every form."""
+    N = 3
+
+    def __init__(self, forms):
+        self.forms = list(forms)
+        self.__postings = {}
+        for i, form in enumerate(self.forms):
+            for gram in set(self.grams(form)):
+                self.__postings.setdefault(gram, []).append(i)
+
+    @classmethod
+    def grams(cls, text):
+        return [text[k:k + cls.N] for k in range(len(text) - cls.N + 1)]
+
+    def __len__(self):
+        return len(self.forms)
+
+    def candidates(self, literals):
+        """Positions, in order, of the forms which may contain every one
+        of ``literals``; those shorter than N don't narrow them down."""
+        grams = {gram for literal in literals for gram in self.grams(literal)}
+        if not grams:
+            return range(len(self.forms))
+        postings = sorted((self.__postings.get(gram, ()) for gram in grams),
+                          key=len)
+        found = set(postings[0])
+        for posting in postings[1:]:
+            if not found:
+                break
+            found.intersection_update(posting)
+        return sorted(found)
+
+    def containing(self, spell):
+        """Positions of the forms containing ``spell``."""
+        forms = self.forms
+        return [i for i in self.candidates((spell,)) if spell in forms[i]]
+
+    def matching(self, pattern):
+        """Positions of the forms where the compiled regex ``pattern``
+        is found, running it only on the candidates of its literals."""
+        forms = self.forms
+        return [i for i in self.candidates(required_literals(pattern))
+                if pattern.search(forms[i]) is not None]
+
+
+_REPEATS = tuple(getattr(_regex_parser, name) for name in
+                 ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+                 if hasattr(_regex_parser, name))
+
+
+def required_literals(pattern):
+    """Strings every match of the compiled regex ``pattern`` contains,
+    eg. ["onji"] for r"^.onji" and ["bro", "da"] for r"bro(da)+". Nothing
+    is required of a regex ignoring case, as far as this tells."""
+    if pattern.flags & re.IGNORECASE or isinstance(pattern.pattern, bytes):
+        return []
+    literals = []
+    _collect_literals(_regex_parser.parse(pattern.pattern, pattern.flags),
+                      literals)
+    return literals
+
+
+def _collect_literals(items, literals):
+    run = []
+    for op, arg in items:
+        if op == _regex_parser.LITERAL:
+            run.append(chr(arg))
+            continue
+        if run:
+            literals.append("".join(run))
+            run = []
+        if op == _regex_parser.SUBPATTERN:
+            _, add_flags, _, body = arg
+            if not add_flags & re.IGNORECASE:
+                _collect_literals(body, literals)
+        elif op in _REPEATS and arg[0] >= 1:
+            _collect_literals(arg[2], literals)
+    if run:
+        literals.append("".join(run))
@@ -1,13 +1,18 @@
 # coding=utf-8
 from vlaste_builder import DictionaryBuilder, WordComponents, Entry
+from vlaste_columnar import ColumnarDictionary
+from vlaste_index import BacklinkIndex, BKTree, EntryIndex, TrigramIndex
 from leven import levenshtein
 import re
 
 class DictionaryManager:
     def __init__(self, builder):
-        if not isinstance(builder, DictionaryBuilder):
-            raise TypeError("builder must be DictionaryBuilder.")
+        if not isinstance(builder, (DictionaryBuilder, ColumnarDictionary)):
+            raise TypeError(
+                "builder must be DictionaryBuilder or ColumnarDictionary.")
         self.builder = builder
+        self.__indexes = {}
+        self.__indexed = None
 
     def get_zpdic(self):
         return self.builder.metadata["zpdic"]
@@ -19,23 +24,120 @@ class DictionaryManager:
     def words(self):
         return self.builder.words
 
+    def forms(self):
+        """Entry forms in word order. A ColumnarDictionary reads them
+        straight from its column, without making word views."""
+        if isinstance(self.builder, ColumnarDictionary):
+            return self.builder.iter_forms()
+        return (word.entry.form for word in self.words)
+
     def filter_by_spell(self, spell, regex=False):
+        words = self.words
         if regex:
-            pattern = re.compile(spell)
-            for word in self.words:
-                    match = pattern.search(word.entry.form)
-                    if match is not None:
-                        yield word
+            ordinals = self.spell_index.matching(re.compile(spell))
         else:
-            for word in self.words:
-                if spell in word.entry.form:
-                    yield word
+            ordinals = self.spell_index.containing(spell)
+        for i in ordinals:
+            yield words[i]
+
+    @property
+    def spell_index(self):
+        """TrigramIndex of the entry forms (see ``_index``)."""
+        return self._index("spell", lambda: TrigramIndex(self.forms()))
 
     def filter_by_levenshtein(self, word_spell, distance):
         words = self.words
-        for word in words:
-            if levenshtein(word_spell, word.entry.form) <= distance:
-                yield word
+        for i in self.leven_tree.ordinals(word_spell, distance):
+            yield words[i]
+
+    def levenshtein_neighbors(self, word_spells, distance):
+        """spell → words within ``distance`` of it, for each of
+        ``word_spells`` (eg. every gismu, to find near collisions)."""
+        words = self.words
+        return {spell: [words[i] for i in ordinals] for spell, ordinals
+                in self.leven_tree.neighbors(word_spells, distance).items()}
+
+    @property
+    def leven_tree(self):
+        """BKTree of the entry forms by levenshtein distance
+        (see ``_index``)."""
+        return self._index("leven",
+                           lambda: BKTree(self.forms(), levenshtein))
+
+    def invalidate(self):
+        """Forget the indexes made from the words. Adding, removing,
+        replacing or reordering words is told by the ``version`` of the
+        words (WordList, LazyWords or the views of a ColumnarDictionary);
+        call it after changing a word itself, eg. its entry."""
+        self.__indexes = {}
+        self.__indexed = None
+
+    def _index(self, name, make):
+        """The index ``name``, made by ``make()`` on first use and made
+        again once the words are no longer those it was made from."""
+        words = self.words
+        if (self.__indexed is None or self.__indexed[0] is not words or
+                self.__indexed[1] != words.version):
+            self.invalidate()
+            self.__indexed = (words, words.version)
+        index = self.__indexes.get(name)
+        if index is None:
+            index = self.__indexes[name] = make()
+        return index
+
+    @property
+    def entry_index(self):
+        """EntryIndex of the words (see ``_index``)."""
+        return self._index(
+            "entry", lambda: EntryIndex.from_dictionary(self.builder))
+
+    @property
+    def backlinks(self):
+        """BacklinkIndex the builder got from relationize, or else one made
+        from the relations of the words (see ``_index``)."""
+        backlinks = getattr(self.builder, 'backlinks', None)
+        if backlinks is not None:
+            return backlinks
+        return self._index(
+            "backlinks", lambda: BacklinkIndex.from_dictionary(self.builder))
+
+    def referenced_by(self, form):
+        """Entries of the words referring to the words having ``form``
+        ("where is this gismu used?")."""
+        entries = []
+        for i in self.entry_index.ordinals(form):
+            entries.extend(self.backlinks.sources(self.words[i].entry.id))
+        return entries
+
+    def find_by_form(self, form):
+        """Words whose entry form is ``form``.
+        Uses the builder's OTMIndex when it has one."""
+        index = getattr(self.builder, 'index', None)
+        if index is not None:
+            return [self.words[i] for i in index.ordinals_by_form(form)]
+        return [self.words[i] for i in self.entry_index.ordinals(form)]
+
+    def lookup(self, form):
+        """Words having ``form``, or if none, those having it up to
+        case, apostrophes and dots (eg. "Ba’e" finds "ba'e")."""
+        return [self.words[i]
+                for i in self.entry_index.ordinals(form, normalized=True)]
+
+    def find_by_id(self, id_):
+        """The word whose entry id is ``id_``, or None."""
+        index = getattr(self.builder, 'index', None)
+        if index is not None:
+            i = index.ordinal_by_id(id_)
+            return None if i is None else self.words[i]
+        if isinstance(self.builder, ColumnarDictionary):
+            try:
+                return self.words[self.builder.ids.index(id_)]
+            except ValueError:
+                return None
+        for word in self.words:
+            if word.entry.id == id_:
+                return word
+        return None
 
     def filter_by_morphology(self, morpho):
         for word in self.words:
@@ -0,0 +1,120 @@
+# coding=utf-8
+import re
+from bisect import bisect_right
+from collections import namedtuple
+
+# Where a word mentions other words.
+FIELDS = ("notes", "関連語")
+# A mention of ``form`` on characters ``span`` of the ``field`` text
+# of the word whose entry id is ``source``.
+Reference = namedtuple("Reference", "source form field span")
+
+_BRACED = re.compile(r"\{([.a-zA-Z']+)\}")
+_TOKEN = re.compile(r"(\{[.a-zA-Z']+\})|([a-zA-Z']+)")
+# Texts are joined by a character no mention can cross.
+_SEPARATOR = "\0"
+
+
+def field_texts(words, fields=FIELDS):
+    """``(entry id, field, text)`` of each of ``fields`` the words have."""
+    for word in words:
+        contents = word.contents
+        for field in fields:
+            if contents.has(field):
+                yield word.entry.id, field, contents.find(field)[1].text
+
+
+def scan(words, fields=FIELDS):
+    """Every ``{form}`` in ``fields`` of ``words`` as a Reference, in word
+    order, then field order, then text order. The form loses the braces
+    and the apostrophes around it.
+
+    All the texts are joined and searched at once, rather than each text
+    on its own."""
+    return scan_texts(field_texts(words, fields))
+
+
+def scan_texts(triples):
+    """``scan`` over ``(source, field, text)`` triples, as given by
+    ``field_texts``; the sources may be anything naming the words."""
+    sources = []
+    starts = []
+    texts = []
+    at = 0
+    for source, field, text in triples:
+        sources.append((source, field))
+        starts.append(at)
+        texts.append(text)
+        at += len(text) + len(_SEPARATOR)
+    references = []
+    for match in _BRACED.finditer(_SEPARATOR.join(texts)):
+        n = bisect_right(starts, match.start()) - 1
+        offset = starts[n]
+        references.append(Reference(
+            sources[n][0], match.group(1).strip("'"), sources[n][1],
+            (match.start() - offset, match.end() - offset)))
+    return references
+
+
+class MentionAutomaton:
+    """Finds forms mentioned without braces, eg. "broda" or "canlu bu".
+
+    Forms are split into tokens of letters and apostrophes, and kept in a
+    trie of tokens; a text is read token by token, taking at each place
+    the longest form starting there. Braced mentions are skipped, and a
+    form never spans anything but white space between its tokens."""
+    def __init__(self, forms):
+        self.__trie = {}
+        for form in forms:
+            tokens = re.findall(r"[a-zA-Z']+", form)
+            if not tokens:
+                continue
+            node = self.__trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            node.setdefault(None, form)
+
+    @classmethod
+    def from_dictionary(cls, dictionary, min_length=4):
+        """Forms shorter than ``min_length`` (mi, do, .i...) are mostly
+        other languages' words when found bare, so they are left out."""
+        return cls(word.entry.form for word in dictionary.words
+                   if len(word.entry.form) >= min_length)
+
+    def find(self, text):
+        """``(form, span)`` of each bare mention in ``text``."""
+        tokens = []
+        for match in _TOKEN.finditer(text):
+            if match.group(1) is None:
+                tokens.append((match.group(2), match.start(), match.end()))
+            else:
+                tokens.append((None, match.start(), match.end()))
+        i = 0
+        while i < len(tokens):
+            node = self.__trie
+            found = None
+            for j in range(i, len(tokens)):
+                token, start, end = tokens[j]
+                if token is None:
+                    break
+                if j > i and not text[tokens[j - 1][2]:start].isspace():
+                    break
+                node = node.get(token)
+                if node is None:
+                    break
+                if None in node:
+                    found = node[None], j
+            if found is None:
+                i += 1
+                continue
+            form, j = found
+            yield form, (tokens[i][1], tokens[j][2])
+            i = j + 1
+
+
+def bare_mentions(words, automaton, fields=FIELDS):
+    """Every form of ``automaton`` found bare in ``fields`` of ``words``,
+    as References in the same order as ``scan``."""
+    return [Reference(source, form, field, span)
+            for source, field, text in field_texts(words, fields)
+            for form, span in automaton.find(text)]